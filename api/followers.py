@@ -1,10 +1,9 @@
-import os
-import json
 import asyncio
 from playwright.async_api import async_playwright
+from api.store import JsonStore
 
-# File path to store follower data
-X_METRICS_FILE = "data/x_metrics.json"
+# Follower count from the previous run
+X_METRICS_STORE = JsonStore("data/x_metrics.json")
 
 async def scrape_x_profile(url: str) -> dict:
     """Scrape an X.com profile to get user data."""
@@ -37,27 +36,19 @@ async def scrape_x_profile(url: str) -> dict:
     
     return None
 
-def load_previous_followers():
+async def load_previous_followers():
     """Loads the previous follower count from a file."""
-    if os.path.exists(X_METRICS_FILE):
-        with open(X_METRICS_FILE, "r") as f:
-            try:
-                data = json.load(f)
-                return data.get("followers", 0)
-            except json.JSONDecodeError:
-                return 0
-    return 0
+    followers = (await X_METRICS_STORE.load({})).get("followers", 0)
+    # saved as {"followers": {"current": count}}
+    return followers.get("current", 0) if isinstance(followers, dict) else followers
 
-def save_followers_count(count):
+async def save_followers_count(count):
     """Saves the current follower count to a file."""
-    os.makedirs("data", exist_ok=True)
-    stats = {"followers": {"current": count}}
-    with open(X_METRICS_FILE, "w") as f:
-        json.dump(stats, f)
+    await X_METRICS_STORE.save({"followers": {"current": count}})
 
 async def get_x_followers_stats():
     """Fetches current followers, calculates the increase, and formats the message."""
-    previous_count = load_previous_followers()
+    previous_count = await load_previous_followers()
     profile = await scrape_x_profile("https://x.com/arcdotfun")
     
     if profile and 'legacy' in profile and 'followers_count' in profile['legacy']:
@@ -70,7 +61,7 @@ async def get_x_followers_stats():
     percent_change = (increase / previous_count * 100) if previous_count else (100 if current_count > 0 else 0)
 
     # Save the new count
-    save_followers_count(current_count)
+    await save_followers_count(current_count)
 
     # Format count with commas
     formatted_count = "{:,}".format(current_count)
@@ -1,100 +1,244 @@
 import os
-import json
+import re
+import asyncio
 import aiohttp
-
-async def get_github_stats():
-    """Fetches GitHub repository statistics (stars, forks, and current release version)."""
-    previous_stats = load_previous_github_stats()  # Get previous stats
-
-    # GitHub API call to fetch the current stats
-    repo = os.getenv("GITHUB_REPO")
-    url = f"https://api.github.com/repos/{repo}"
-
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as response:
-            if response.status == 200:
-                data = await response.json()
-
-                # Get the required stats: stars, forks, and latest release version
-                stars = data.get("stargazers_count", 0)
-                forks = data.get("forks_count", 0)
-
-                # Get the latest release version (now async)
-                release_version = await get_current_release_version(session, repo)
-
-                # Format stats into a dictionary
-                current_stats = {
-                    "stars": stars,
-                    "forks": forks,
-                    "release_version": release_version
-                }
-
-                # Calculate increases and percentage changes for stars and forks (release version is not numeric)
-                stats = {}
-                for key in current_stats:
-                    current_value = current_stats[key]
-                    previous_value = previous_stats.get(key, 0)
-
-                    # Only calculate percentage changes for numeric values
-                    if key != "release_version":
-                        # Ensure current_value is an integer for stars and forks
-                        current_value = int(current_value) if isinstance(current_value, str) else current_value
-                        previous_value = int(previous_value) if isinstance(previous_value, str) else previous_value
-
-                        # Calculate increases and percentage changes
-                        if previous_value == 0:
-                            increase = current_value
-                            percent_change = 100 if current_value > 0 else 0
-                        else:
-                            increase = current_value - previous_value
-                            percent_change = (increase / previous_value * 100) if previous_value else 0
-                    else:
-                        increase = "N/A"
-                        percent_change = "N/A"
-
-                    stats[key] = {
-                        'current': current_value if key != "release_version" else release_version,
-                        'increase': increase,
-                        'percent_change': percent_change
-                    }
-
-                # Save current stats to file for future comparisons
-                save_current_github_stats(current_stats)
-
-                # Format the stats into a message with commas for stars and forks
-                formatted_stars = "{:,}".format(stats['stars']['current'])
-                formatted_forks = "{:,}".format(stats['forks']['current'])
-
-                # Correct the message formatting
-                message = f"⭐️ Github Stars  >>  {formatted_stars} ({stats['stars']['percent_change']:.2f}%)\n"
-                message += f"🍴 Github Forks  >>  {formatted_forks} ({stats['forks']['percent_change']:.2f}%)\n"
-                message += f"🔖 Rig Version  >>  {stats['release_version']['current']}"
-
-                return message
-            else:
-                return "❌ Error fetching GitHub stats."
-
-async def get_current_release_version(session, repo):
-    """Fetches the latest release version from the repository asynchronously."""
-    url = f"https://api.github.com/repos/{repo}/releases/latest"
-    async with session.get(url) as response:
-        if response.status == 200:
-            data = await response.json()
-            return data.get("tag_name", "N/A")  # Default to 'N/A' if no release exists
-    return "N/A"  
-
-def load_previous_github_stats():
-    """Loads previous GitHub stats from file or fetches current stats if the file is missing."""
-    if os.path.exists("data/github_metrics.json"):
-        with open("data/github_metrics.json", "r") as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                return {}  # Return empty dict if the file is invalid
-    else:
-        return {}  # If the file does not exist, return empty dict
-
-def save_current_github_stats(stats):
-    """Saves the current GitHub stats to file."""
-    with open("data/github_metrics.json", "w") as f:
-        json.dump(stats, f)
\ No newline at end of file
+from api.store import JsonStore
+
+GITHUB_API_URL = "https://api.github.com"
+GITHUB_GRAPHQL_URL = "https://api.github.com/graphql"
+
+# Stats from the previous run, keyed by repo
+GITHUB_METRICS_STORE = JsonStore("data/github_metrics.json")
+
+# ETags and bodies of REST responses, so unchanged resources come back as 304s
+GITHUB_CACHE_STORE = JsonStore("data/github_cache.json")
+
+# Saved with each repo's stats once contributors always come from the REST listing. Earlier
+# saves may hold GraphQL's mentionable users instead, which isn't comparable.
+CONTRIBUTORS_SOURCE = "rest_anon"
+
+REPO_FIELDS = """
+    nameWithOwner
+    stargazerCount
+    forkCount
+    latestRelease { tagName }
+    issues(states: OPEN) { totalCount }
+    pullRequests(states: OPEN) { totalCount }
+"""
+
+def get_repos():
+    """Repos to track: comma-separated GITHUB_REPOS, or the single GITHUB_REPO."""
+    repos = os.getenv("GITHUB_REPOS") or os.getenv("GITHUB_REPO") or ""
+    return [repo.strip() for repo in repos.split(",") if repo.strip()]
+
+def build_graphql_query(repos):
+    """One query for every repo, each under its own alias (r0, r1, ...)."""
+    variables = {}
+    definitions = []
+    selections = []
+    for index, repo in enumerate(repos):
+        owner, name = repo.split("/", 1)
+        variables[f"owner{index}"] = owner
+        variables[f"name{index}"] = name
+        definitions.append(f"$owner{index}: String!, $name{index}: String!")
+        selections.append(f"r{index}: repository(owner: $owner{index}, name: $name{index}) {{{REPO_FIELDS}}}")
+    query = f"query({', '.join(definitions)}) {{\n" + "\n".join(selections) + "\n}"
+    return query, variables
+
+async def fetch_graphql_stats(session, repos, token):
+    """Fetches stats for all repos in a single GraphQL request. GraphQL has no contributor count, see fetch_contributors."""
+    query, variables = build_graphql_query(repos)
+    headers = {"Authorization": f"bearer {token}"}
+    async with session.post(GITHUB_GRAPHQL_URL, json={"query": query, "variables": variables}, headers=headers) as response:
+        if response.status != 200:
+            print(f"GitHub GraphQL error: {response.status}")
+            return None
+        payload = await response.json()
+
+    if payload.get("errors"):
+        print(f"GitHub GraphQL error: {payload['errors'][0].get('message')}")
+    data = payload.get("data") or {}
+
+    stats = {}
+    for index, repo in enumerate(repos):
+        node = data.get(f"r{index}")
+        if not node:
+            continue
+        stats[repo] = {
+            "stars": node["stargazerCount"],
+            "forks": node["forkCount"],
+            "release_version": (node.get("latestRelease") or {}).get("tagName", "N/A"),
+            "open_issues": node["issues"]["totalCount"],
+            "open_prs": node["pullRequests"]["totalCount"],
+        }
+    return stats
+
+def count_from_link_header(link_header, items_on_page):
+    """Total items of a per_page=1 listing: the page number of its rel="last" link."""
+    match = re.search(r'[?&]page=(\d+)>; rel="last"', link_header or "")
+    return int(match.group(1)) if match else items_on_page
+
+async def rest_get(session, cache, url, headers):
+    """GET with If-None-Match. Returns (status, body, count) and updates the ETag cache.
+
+    count is the total item count derived from the Link header, for per_page=1 listings.
+    """
+    cached = cache.get(url)
+    request_headers = dict(headers)
+    if cached:
+        request_headers["If-None-Match"] = cached["etag"]
+
+    async with session.get(url, headers=request_headers) as response:
+        if response.status == 304 and cached:
+            return 200, cached["body"], cached["count"]
+        if response.status != 200:
+            return response.status, None, 0
+        body = await response.json()
+        count = count_from_link_header(response.headers.get("Link"), len(body) if isinstance(body, list) else 0)
+        if response.headers.get("ETag"):
+            cache[url] = {"etag": response.headers["ETag"], "body": body, "count": count}
+        return 200, body, count
+
+async def fetch_contributors(session, cache, repo, headers):
+    """Contributor count, anonymous contributors included, from the REST listing. None if it failed.
+
+    Both the GraphQL and the REST path use this, so runs always compare the same number.
+    """
+    status, _, contributors = await rest_get(session, cache, f"{GITHUB_API_URL}/repos/{repo}/contributors?per_page=1&anon=true", headers)
+    if status != 200:
+        print(f"GitHub REST error for {repo} contributors: {status}")
+        return None
+    return contributors
+
+async def fetch_rest_repo_stats(session, cache, repo, headers):
+    """Fetches one repo's stats from the REST API (repo, latest release, open PRs, contributors).
+
+    A count whose listing failed is None (unknown) rather than 0.
+    """
+    base = f"{GITHUB_API_URL}/repos/{repo}"
+    (status, data, _), (_, release, _), (prs_status, _, open_prs), contributors = await asyncio.gather(
+        rest_get(session, cache, base, headers),
+        rest_get(session, cache, f"{base}/releases/latest", headers),
+        rest_get(session, cache, f"{base}/pulls?state=open&per_page=1", headers),
+        fetch_contributors(session, cache, repo, headers),
+    )
+    if status != 200:
+        print(f"GitHub REST error for {repo}: {status}")
+        return None
+    if prs_status != 200:
+        print(f"GitHub REST error for {repo} pulls: {prs_status}")
+        open_prs = None
+    return {
+        "stars": data.get("stargazers_count", 0),
+        "forks": data.get("forks_count", 0),
+        "release_version": (release or {}).get("tag_name", "N/A"),  # Default to 'N/A' if no release exists
+        # open_issues_count includes open pull requests, so it is unknown without the PR count
+        "open_issues": max(data.get("open_issues_count", 0) - open_prs, 0) if open_prs is not None else None,
+        "open_prs": open_prs,
+        "contributors": contributors,
+    }
+
+async def fetch_rest_stats(session, graphql_repos, rest_repos, token=None):
+    """REST requests of a run, using cached ETags so unchanged resources cost a 304.
+
+    Returns (contributor count of each GraphQL repo, full stats of each REST repo).
+    """
+    cache = await GITHUB_CACHE_STORE.load({})
+    headers = {"Accept": "application/vnd.github+json"}
+    if token:
+        headers["Authorization"] = f"bearer {token}"
+
+    contributors, results = await asyncio.gather(
+        asyncio.gather(*(fetch_contributors(session, cache, repo, headers) for repo in graphql_repos)),
+        asyncio.gather(*(fetch_rest_repo_stats(session, cache, repo, headers) for repo in rest_repos)),
+    )
+    await GITHUB_CACHE_STORE.save(cache)
+    return dict(zip(graphql_repos, contributors)), {repo: stats for repo, stats in zip(rest_repos, results) if stats}
+
+async def collect_github_stats(session, repos):
+    """Current stats for every repo: one GraphQL query with GITHUB_TOKEN, REST with ETags for the rest.
+
+    Repos the GraphQL query didn't return (or all of them, without a token) are fetched over REST.
+    Contributors always come from REST.
+    """
+    token = os.getenv("GITHUB_TOKEN")
+    stats = {}
+    if token:
+        stats = await fetch_graphql_stats(session, repos, token) or {}
+    missing = [repo for repo in repos if repo not in stats]
+    contributors, rest_stats = await fetch_rest_stats(session, list(stats), missing, token)
+    for repo, count in contributors.items():
+        stats[repo]["contributors"] = count
+    stats.update(rest_stats)
+    return stats
+
+def calculate_percent_change(current_value, previous_value):
+    """Percentage change from the previous run, 100% when there is no previous value."""
+    if previous_value == 0:
+        return 100 if current_value > 0 else 0
+    return (current_value - previous_value) / previous_value * 100
+
+def load_previous_repo_stats(previous_stats, repos):
+    """Previous stats keyed by repo. The old single-repo file format maps to the first repo.
+
+    A contributor count saved without CONTRIBUTORS_SOURCE is dropped, it may be a different metric.
+    """
+    if "stars" in previous_stats and repos:
+        previous_stats = {repos[0]: previous_stats}
+    return {
+        repo: {key: value for key, value in stats.items()
+               if key != "contributors" or stats.get("contributors_source") == CONTRIBUTORS_SOURCE}
+        for repo, stats in previous_stats.items()
+    }
+
+def merge_repo_stats(previous, current):
+    """Stats to save: the current ones, keeping the previous value of any count that is unknown this run."""
+    merged = {**previous, **{key: value for key, value in current.items() if value is not None}}
+    if "contributors" in merged:
+        merged["contributors_source"] = CONTRIBUTORS_SOURCE
+    return merged
+
+def format_repo_stats(current, previous):
+    def line(emoji, label, key):
+        if current.get(key) is None:
+            return f"{emoji} {label}  >>  unknown"
+        current_value = int(current[key])
+        previous_value = int(previous.get(key) or 0)
+        return f"{emoji} {label}  >>  {current_value:,} ({calculate_percent_change(current_value, previous_value):.2f}%)"
+
+    return "\n".join([
+        line("⭐️", "Github Stars", "stars"),
+        line("🍴", "Github Forks", "forks"),
+        line("🐛", "Open Issues", "open_issues"),
+        line("🔀", "Open PRs", "open_prs"),
+        line("🧑‍💻", "Contributors", "contributors"),
+        f"🔖 Rig Version  >>  {current['release_version']}",
+    ])
+
+async def get_github_stats(session=None):
+    """Fetches GitHub stats for every tracked repo and formats them against the previous run."""
+    repos = get_repos()
+    if not repos:
+        return "❌ Error fetching GitHub stats."
+
+    if session is None:
+        async with aiohttp.ClientSession() as own_session:
+            return await get_github_stats(own_session)
+
+    previous_stats = load_previous_repo_stats(await GITHUB_METRICS_STORE.load({}), repos)
+    current_stats = await collect_github_stats(session, repos)
+    if not current_stats:
+        return "❌ Error fetching GitHub stats."
+
+    # Save current stats to file for future comparisons, keeping repos that failed this run
+    await GITHUB_METRICS_STORE.save({
+        **previous_stats,
+        **{repo: merge_repo_stats(previous_stats.get(repo, {}), stats) for repo, stats in current_stats.items()},
+    })
+
+    if len(repos) == 1:
+        return format_repo_stats(current_stats[repos[0]], previous_stats.get(repos[0], {}))
+    return "\n\n".join(
+        f"📦 {repo}\n" + format_repo_stats(current_stats[repo], previous_stats.get(repo, {}))
+        for repo in repos if repo in current_stats
+    )
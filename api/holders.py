@@ -1,14 +1,23 @@
-import json
 import os
 import aiohttp
+from api.store import JsonStore
 
 # Fetch system environment variables
 TOKEN_MINT_ADDRESS = os.getenv("TOKEN_ADDRESS")
 HELIUS_API_KEY = os.getenv("HELIUS_API_KEY")
 
-async def get_token_holders():
-    """Fetches the total token holder count using Helius getTokenAccounts API asynchronously."""
-    
+# Holder count from the previous run
+TOKEN_HOLDERS_STORE = JsonStore("data/token_holders.json")
+
+async def get_token_holders(session=None):
+    """Fetches the total token holder count using Helius getTokenAccounts API asynchronously.
+
+    Uses the given aiohttp session, or a session of its own when none is passed.
+    """
+    if session is None:
+        async with aiohttp.ClientSession() as own_session:
+            return await get_token_holders(own_session)
+
     url = f"https://mainnet.helius-rpc.com/?api-key={HELIUS_API_KEY}"
     
     payload = {
@@ -30,62 +39,51 @@ async def get_token_holders():
     has_more = True
     cursor = None
 
-    async with aiohttp.ClientSession() as session:
-        while has_more:
-            if cursor:
-                payload["params"]["cursor"] = cursor
-            
-            async with session.post(url, headers=headers, json=payload) as response:
-                if response.status == 200:
-                    data = await response.json()
+    while has_more:
+        if cursor:
+            payload["params"]["cursor"] = cursor
+        
+        async with session.post(url, headers=headers, json=payload) as response:
+            if response.status == 200:
+                data = await response.json()
+                
+                if "error" in data:
+                    print(f"API Error: {data['error']['message']}")
+                    return 0
                     
-                    if "error" in data:
-                        print(f"API Error: {data['error']['message']}")
-                        return 0
-                        
-                    if "result" in data and "token_accounts" in data["result"]:
-                        accounts = data["result"]["token_accounts"]
-                        
-                        for account in accounts:
-                            if "owner" in account:
-                                unique_holders.add(account["owner"])
-                        
-                        if "cursor" in data["result"] and data["result"]["cursor"]:
-                            cursor = data["result"]["cursor"]
-                        else:
-                            has_more = False
+                if "result" in data and "token_accounts" in data["result"]:
+                    accounts = data["result"]["token_accounts"]
+                    
+                    for account in accounts:
+                        if "owner" in account:
+                            unique_holders.add(account["owner"])
+                    
+                    if "cursor" in data["result"] and data["result"]["cursor"]:
+                        cursor = data["result"]["cursor"]
                     else:
                         has_more = False
                 else:
-                    print(f"Error fetching data: {response.status}")
                     has_more = False
+            else:
+                print(f"Error fetching data: {response.status}")
+                has_more = False
     
     holder_count = len(unique_holders)
     return holder_count
 
-def load_previous_token_stats():
+async def load_previous_token_stats():
     """Loads previous token holder count from file or returns 0 if not available."""
-    if os.path.exists("data/token_holders.json"):
-        with open("data/token_holders.json", "r") as f:
-            try:
-                data = json.load(f)
-                return data.get("holders", {}).get("current", 0)
-            except json.JSONDecodeError:
-                return 0
-    else:
-        return 0
+    data = await TOKEN_HOLDERS_STORE.load({})
+    return data.get("holders", {}).get("current", 0)
 
-def save_current_token_stats(current_count):
+async def save_current_token_stats(current_count):
     """Saves the current token holder count to file."""
-    os.makedirs("data", exist_ok=True)
-    stats = {"holders": {"current": current_count}}
-    with open("data/token_holders.json", "w") as f:
-        json.dump(stats, f)
+    await TOKEN_HOLDERS_STORE.save({"holders": {"current": current_count}})
 
-async def get_token_stats():
+async def get_token_stats(session=None):
     """Fetches token stats asynchronously and returns a formatted message."""
-    previous_count = load_previous_token_stats()
-    current_count = await get_token_holders()  
+    previous_count = await load_previous_token_stats()
+    current_count = await get_token_holders(session)
     
     if previous_count == 0:
         increase = current_count
@@ -94,7 +92,7 @@ async def get_token_stats():
         increase = current_count - previous_count
         percent_change = (increase / previous_count * 100) if previous_count else 0
     
-    save_current_token_stats(current_count)
+    await save_current_token_stats(current_count)
     
     formatted_count = "{:,}".format(current_count)
     
@@ -0,0 +1,34 @@
+import os
+import json
+import asyncio
+
+class JsonStore:
+    """JSON file whose reads and writes run in a worker thread, so they never block the event loop."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _read(self, default):
+        if not os.path.exists(self.path):
+            return default
+        with open(self.path, "r") as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                return default  # Return default if the file is invalid
+
+    def _write(self, data):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # write to a temp file and swap it in, so readers never see a half-written file
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    async def load(self, default=None):
+        """Loads the file contents, or default if the file is missing or invalid."""
+        return await asyncio.get_running_loop().run_in_executor(None, self._read, default)
+
+    async def save(self, data):
+        """Saves data to the file."""
+        await asyncio.get_running_loop().run_in_executor(None, self._write, data)
@@ -1,52 +1,47 @@
+from time import perf_counter
+STARTUP_STARTED = perf_counter()
+
 import os
-import re
-import json
+import logging
 import subprocess
 from dotenv import load_dotenv
-from telegram import Update, ChatPermissions, ParseMode
-from telegram.ext import Updater, MessageHandler, Filters, CallbackContext, CommandHandler, Filters
-from collections import defaultdict, deque
-from datetime import datetime, timedelta, timezone, time
+from telegram import Update, ParseMode
+from telegram.ext import Updater, CallbackContext, CommandHandler, TypeHandler
+from datetime import time
 from combot.scheduled_warnings import messages
 from combot.brand_assets import messages as brand_assets_messages
+from moderation.handlers import COMMANDS_GROUP, PROFILE_TOP_N, get_admin_ids, moderation_counters, setup_moderation
+from moderation.log import dropped_records, get_logger, log_event, setup_logging
+from moderation.spam_store import DEFAULT_SQLITE_PATH
+from moderation.workers import start_telegram_workers
+from moderation.profiling import profile_in_background
+from moderation.metrics import MetricsService, load_collectors
 
 load_dotenv()  # Load .env vars
 
+# JSON logs through a background queue (see moderation/log.py)
+setup_logging()
+logger = get_logger("bot")
+
 # Get bot token from environment
 BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 GROUP_CHAT_ID = os.getenv('GROUP_CHAT_ID')
 
-# File path for filters
-FILTERS_FILE = "filters/filters.json"
-
-# File path for accompanying filter media
-MEDIA_FOLDER = "media"
-
-# File paths for phrases
-BAN_PHRASES_FILE = "blocklists/ban_phrases.txt"
-MUTE_PHRASES_FILE = "blocklists/mute_phrases.txt"
-DELETE_PHRASES_FILE = "blocklists/delete_phrases.txt"
-WHITELIST_PHRASES_FILE = "whitelists/whitelist_phrases.txt"
+# Profile the first PROFILE_ON_START seconds after startup (admins can also run /profile <seconds>)
+PROFILE_ON_START = int(os.getenv('PROFILE_ON_START', '0'))
 
-# Suspicious names to auto-ban
-SUSPICIOUS_USERNAMES = [
-    "dev", "developer", "admin", "mod", "owner", "arc", "arc_agent", "arc agent", "arch_agent", "arch agent", "support", "helpdesk", "administrator", "arc admin", "arc_admin"
-]
+# Community metrics (see moderation/metrics.py): daily collection time as HH:MM UTC (unset = off),
+# and whether each run is posted to the group. Posting is off by default so a deploy that
+# also runs metrics_bot.py doesn't post twice.
+METRICS_TIME = os.getenv('METRICS_TIME', '')
+METRICS_POST = os.getenv('METRICS_POST', '0').lower() in ('1', 'true', 'yes')
 
-# Mute duration in seconds (3 days)
-MUTE_DURATION = 3 * 24 * 60 * 60
+# Worker processes for multi-process mode (0 = handle everything in this process)
+MODERATION_WORKERS = int(os.getenv('MODERATION_WORKERS', '0'))
 
-# auto spam detection variables
-SPAM_THRESHOLD = 3
-TIME_WINDOW = timedelta(seconds=15)
-SPAM_TRACKER = defaultdict(lambda: deque(maxlen=SPAM_THRESHOLD))
-SPAM_RECORDS = {} # stores flagged spam messages for 5 minutes
-SPAM_RECORD_DURATION = timedelta(minutes=5)
-
-def get_admin_ids(context, chat_id):
-    # Fetch chat admins dynamically
-    chat_admins = context.bot.get_chat_administrators(chat_id)
-    return [admin.user.id for admin in chat_admins]
+# Workers share the spam window through SQLite (see moderation/spam_store.py)
+if MODERATION_WORKERS > 0:
+    os.environ.setdefault('SPAM_STORE_PATH', DEFAULT_SQLITE_PATH)
 
 # combot security message
 def post_security_message(context: CallbackContext, index: int):
@@ -57,13 +52,13 @@ def post_security_message(context: CallbackContext, index: int):
             try:
                 context.bot.unpin_chat_message(chat_id=GROUP_CHAT_ID, message_id=pinned.message_id)
             except Exception as e:
-                print(f"[Security] Failed to unpin message: {e}")
+                log_event(logger, logging.ERROR, "security_message_unpin_failed", error=str(e))
             try:
                 context.bot.delete_message(chat_id=GROUP_CHAT_ID, message_id=pinned.message_id)
             except Exception as e:
-                print(f"[Security] Failed to delete message: {e}")
+                log_event(logger, logging.ERROR, "security_message_delete_failed", error=str(e))
     except Exception as e:
-        print(f"[Security] Failed to retrieve chat or pinned message: {e}")
+        log_event(logger, logging.ERROR, "security_message_get_chat_failed", error=str(e))
     try:
         message = messages[index]
         sent_message = context.bot.send_message(
@@ -77,7 +72,7 @@ def post_security_message(context: CallbackContext, index: int):
             disable_notification=True
         )
     except Exception as e:
-        print(f"[Security] Failed to pin message: {e}")
+        log_event(logger, logging.ERROR, "security_message_pin_failed", error=str(e))
 
 # combot brand assets
 def post_brand_assets(context: CallbackContext, index: int = 0):
@@ -88,13 +83,13 @@ def post_brand_assets(context: CallbackContext, index: int = 0):
             try:
                 context.bot.unpin_chat_message(chat_id=GROUP_CHAT_ID, message_id=pinned.message_id)
             except Exception as e:
-                print(f"[Brand Assets] Failed to unpin message: {e}")
+                log_event(logger, logging.ERROR, "brand_assets_unpin_failed", error=str(e))
             try:
                 context.bot.delete_message(chat_id=GROUP_CHAT_ID, message_id=pinned.message_id)
             except Exception as e:
-                print(f"[Brand Assets] Failed to delete message: {e}")
+                log_event(logger, logging.ERROR, "brand_assets_delete_failed", error=str(e))
     except Exception as e:
-        print(f"[Brand Assets] Failed to retrieve chat or pinned message: {e}")
+        log_event(logger, logging.ERROR, "brand_assets_get_chat_failed", error=str(e))
     try:
         message = brand_assets_messages[index]
         sent_message = context.bot.send_message(
@@ -108,306 +103,38 @@ def post_brand_assets(context: CallbackContext, index: int = 0):
             disable_notification=True
         )
     except Exception as e:
-        print(f"[Brand Assets] Failed to send or pin message: {e}")
-
-# Load filters as dict
-def load_filters(file_path):
-    with open(file_path, 'r', encoding='utf-8') as file:
-        return json.load(file)
-
-FILTERS = load_filters(FILTERS_FILE)
-
-# Load blocklist/whitelisted words/phrases from files
-def load_phrases(file_path):
-    with open(file_path, 'r', encoding='utf-8') as file:
-        return [line.strip().lower() for line in file.readlines()]
-
-BAN_PHRASES = load_phrases(BAN_PHRASES_FILE)
-MUTE_PHRASES = load_phrases(MUTE_PHRASES_FILE)
-DELETE_PHRASES = load_phrases(DELETE_PHRASES_FILE)
-WHITELIST_PHRASES = load_phrases(WHITELIST_PHRASES_FILE)
-
-def contains_multiplication_phrase(text):
-    text = text.lower()
-    # Match digit(s) possibly separated by spaces, next to an 'x'
-    pattern = r"(?:\d\s*)+x|x\s*(?:\d\s*)+"
-    return re.search(pattern, text)
-
-def contains_give_sol_phrase(text):
-    text = text.lower()
-    # Match 'give' followed by a number and then 'sol' or 'solana'
-    pattern = r"give\s*(\d+)\s*(sol|solana)"
-    return re.search(pattern, text)
-
-# check for spam
-def check_for_spam(message_text, user_id):
-    now = datetime.now(timezone.utc)
-    # track user and timestamp of the message
-    print(f"Checking for spam: {message_text} from user: {user_id}")
-    SPAM_TRACKER[message_text].append((user_id, now))
-
-    # Filter out old messages that are outside of the time window
-    recent = [entry for entry in SPAM_TRACKER[message_text] if now - entry[1] <= TIME_WINDOW]
-    SPAM_TRACKER[message_text] = deque(recent)
-
-    print(f"Recent messages for '{message_text}': {recent}")
-
-    # If recent messages exceed the threshold, flag as spam
-    if len(recent) >= SPAM_THRESHOLD:
-        print(f"Spam detected for message: '{message_text}'")
-        # flag message as spam and store for 5 minutes in memory
-        SPAM_RECORDS[message_text] = now # only store message and timestamp
-        spammer_ids = list(set([entry[0] for entry in recent])) # Return list of user_ids to mute
-        print(f"Flagging {len(spammer_ids)} users for spam: {spammer_ids}") 
-        return spammer_ids
-    
-    elif recent and len(recent) < SPAM_THRESHOLD and (now - recent[0][1] > TIME_WINDOW):
-        # Not spam, expired window – clean it up
-        SPAM_TRACKER.pop(message_text, None)
-
-    return []
-
-# check for recent spam and mute spammers
-def check_recent_spam(message_text):
-    now = datetime.now(timezone.utc)
-    timestamp = SPAM_RECORDS.get(message_text)
-    if timestamp:
-        print(f"Message '{message_text}' is flagged as spam, timestamp: {timestamp}")
-    return timestamp and (now - timestamp <= SPAM_RECORD_DURATION)
-
-# clean up spam records
-def cleanup_spam_records(context: CallbackContext):
-    now = datetime.now(timezone.utc)
-    expired_messages = []
-
-    for message_text, timestamp in list(SPAM_RECORDS.items()):
-        if now - timestamp > SPAM_RECORD_DURATION:
-            expired_messages.append(message_text)
-            del SPAM_RECORDS[message_text]
-            print(f"[CLEANUP] Removed expired spam record: '{message_text}'")
-
-    if not expired_messages:
-        print("[CLEANUP] No expired spam messages to remove.")
-
-def contains_non_x_links(text: str) -> bool:
-    # Matches all URLs
-    url_pattern = r'(https?://[^\s]+)'
-    urls = re.findall(url_pattern, text)
-
-    for url in urls:
-        # Allow only Twitter/X links
-        if not re.search(r'https?://(www\.)?(x\.com|twitter\.com)/[^\s]+', url):
-            return True  # Found a non-X link
-    return False
-
-# Suspicious auto-ban function
-def handle_new_members(update, context):
-    message = update.message
-    if message is None or not message.new_chat_members:
+        log_event(logger, logging.ERROR, "brand_assets_send_failed", error=str(e))
+
+# job: collect metrics on the metrics loop, posting the report to the group when done
+def collect_metrics(metrics, context: CallbackContext):
+    on_report = None
+    if METRICS_POST:
+        on_report = lambda text: context.bot.send_message(chat_id=GROUP_CHAT_ID, text=text)
+    metrics.collect(on_report)
+
+# admin-only: latest cached metrics plus moderation counters, without fetching anything
+def stats_command(metrics, update: Update, context: CallbackContext):
+    if update.effective_user.id not in get_admin_ids(context, GROUP_CHAT_ID):
         return
 
-    chat_id = message.chat.id
-
-    for new_user in message.new_chat_members:
-        name = new_user.full_name or "No Name"
-        username = new_user.username or "No Username"
-        user_id = new_user.id
-
-        name_info = f"Name: {name}, Username: @{username}" if new_user.username else f"Name: {name} (no username)"
-        print(f"[JOIN] {name_info} (ID: {user_id})")
-
-        name_lower = name.lower()
-        username_lower = username.lower()
-
-        if any(keyword in name_lower or keyword in username_lower for keyword in SUSPICIOUS_USERNAMES):
-            try:
-                context.bot.ban_chat_member(chat_id, user_id)
-                print(f"[BANNED] Suspicious user auto-banned: {name_info}")
-            except Exception as e:
-                print(f"[ERROR] Failed to ban {user_id}: {e}")
-
-def check_message(update: Update, context: CallbackContext):
-    should_skip_spam_check = False
-    
-    message = update.message or update.channel_post  # Handle both messages and channel posts
-    if not message:
-        print("==== No message or channel post detected ====")
-        return
-    
-    message_text = message.text.lower()
-    chat_id = update.effective_chat.id
-    user_id = update.effective_user.id
-    user = update.effective_user
-
-    # Fetch chat admins to prevent acting on their messages
-    chat_admins = context.bot.get_chat_administrators(chat_id)
-    admin_ids = [admin.user.id for admin in chat_admins]
-    
-    # If the message starts with /say, the bot will send a message on behalf of the admin
-    if message_text.startswith('/say '):
-        # Ensure the user is an admin (using admin_ids already fetched)
-        if user_id in admin_ids:
-            # Get the message after the /say command
-            say_message = message_text[len('/say '):].strip()
-                        
-            # Ensure the message is not empty
-            if say_message:
-                context.bot.delete_message(chat_id=chat_id, message_id=message.message_id)
-                # Send the message as the bot
-                context.bot.send_message(
-                    chat_id=chat_id,
-                    text=say_message,
-                    parse_mode=ParseMode.HTML  # If you want to support HTML formatting
-                )
-            else:
-                print("Empty say_message, skipping send.") 
-            return  # After processing /say, exit the function
-    
-    # Ignore messages from admins
-    if user_id not in admin_ids:
-
-        # check if message is too short
-        if len(message_text.strip()) < 2:
-            context.bot.delete_message(chat_id=chat_id, message_id=message.message_id)
-            return
-
-        # Auto-ban based on suspicious name or username
-        name_username = f"{user.full_name} {user.username or ''}".lower()
-        if any(keyword in name_username for keyword in SUSPICIOUS_USERNAMES):
-            context.bot.ban_chat_member(chat_id=chat_id, user_id=user_id)
-            return
-        
-        # Delete message if it contains non-X links
-        if contains_non_x_links(message.text):
-            print(f"[LINK FILTER] Message from user {user_id} contains non-X links. Deleting.")
-            context.bot.delete_message(chat_id=chat_id, message_id=message.message_id)
-            return
-
-        # Check for multiplication spam
-        if contains_multiplication_phrase(message_text):
-            context.bot.delete_message(chat_id=chat_id, message_id=message.message_id)
-            return
-        
-        # Check for "give x sol" or "give x solana" spam
-        if contains_give_sol_phrase(message_text):
-            context.bot.delete_message(chat_id=chat_id, message_id=message.message_id)
-            return
-        
-        # Block forwarded messages from non-admins
-        if message.forward_date or message.forward_from or message.forward_from_chat:
-            print(f"[FORWARD DETECTED] User {user_id} forwarded a message.")
-            context.bot.delete_message(chat_id=chat_id, message_id=message.message_id)
-            return
-        
-        # 1. autospam - check if its a command or matches a filter
-        for trigger in FILTERS.keys():
-            normalized_trigger = trigger.strip().lower()
-            pattern = rf'(?<!\w)/?{re.escape(normalized_trigger)}(_\w+)?(?!\w)'
-            if re.search(pattern, message_text):
-                should_skip_spam_check = True
-                print(f"[SPAM CHECK SKIPPED] Message '{message_text}' matched FILTER trigger: '{trigger}'")
-                break
-
-        # 2. autospam - check whitelist
-        if not should_skip_spam_check:
-            if message_text.strip() in WHITELIST_PHRASES:
-                print(f"[SPAM CHECK SKIPPED] Message '{message_text}' matched WHITELIST.")
-                should_skip_spam_check = True
-
-        # 3. autospam - check for spam
-        if not should_skip_spam_check:
-            # Run spam detection only if no FILTER trigger matched
-            spammer_ids = check_for_spam(message_text, user_id)
-
-            if check_recent_spam(message_text) and user_id not in spammer_ids:
-                spammer_ids.append(user_id)
-
-            if spammer_ids:
-                print(f"Muting spammers for message: '{message_text}'")
-                for spammer_id in set(spammer_ids):
-                    try:
-                        until_date = message.date + timedelta(seconds=MUTE_DURATION)
-                        permissions = ChatPermissions(can_send_messages=False)
-                        context.bot.restrict_chat_member(chat_id=chat_id, user_id=spammer_id, permissions=permissions, until_date=until_date)
-                        print(f"Muted user {spammer_id} for spam message.")
-                    except Exception as e:
-                        print(f"Failed to mute spammer {spammer_id}: {e}")
-                return
-    
-        # Check for banned phrases
-        for phrase in BAN_PHRASES:
-            # Use word boundaries to match exact words
-            if re.search(r'\b' + re.escape(phrase) + r'\b', message_text):
-                print(f"[BAN MATCH] Phrase: '{phrase}' matched in message: '{message_text}'")
-                context.bot.ban_chat_member(chat_id=chat_id, user_id=user.id)
-                message.reply_text(f"arc angel fallen. {user.first_name} has been banned.")
-                return
-
-        # Check for muted phrases
-        for phrase in MUTE_PHRASES:
-            # Use word boundaries to match exact words
-            if re.search(r'\b' + re.escape(phrase) + r'\b', message_text):
-                print(f"[MUTE MATCH] Phrase: '{phrase}' matched in message: '{message_text}'")
-                until_date = message.date + timedelta(seconds=MUTE_DURATION)
-                permissions = ChatPermissions(can_send_messages=False)
-                context.bot.restrict_chat_member(chat_id=chat_id, user_id=user.id, permissions=permissions, until_date=until_date)
-                message.reply_text(f"{user.first_name} has been muted for 3 days.")
-                return
-
-        # Check for deleted phrases
-        for phrase in DELETE_PHRASES:
-            # Use word boundaries to match exact words
-            if re.search(r'\b' + re.escape(phrase) + r'\b', message_text):
-                print(f"[DELETE MATCH] Phrase: '{phrase}' matched in message: '{message_text}'")
-                context.bot.delete_message(chat_id=chat_id, message_id=message.message_id)
-                return
-
-    # Filter Responses (apply to all)
-    for trigger, filter_data in FILTERS.items():
-        normalized_trigger = trigger.strip().lower()
-        # use word boundaries but allow underscores to be appended
-        pattern = rf'(?<!\w)/?{re.escape(normalized_trigger)}(_\w+)?(?!\w)'
-        
-        if re.search(pattern, message_text):
-            response_text = filter_data.get("response_text", "")
-            media_file = filter_data.get("media")
-            media_type = filter_data.get("type", "gif").lower()
-
-            if media_file:
-                media_path = os.path.join(MEDIA_FOLDER, media_file)
-                if os.path.exists(media_path):
-                    with open(media_path, 'rb') as media:
-                        if media_type in ["gif", "animation"]:
-                            context.bot.send_animation(chat_id=chat_id, animation=media, caption=response_text or None)
-                        elif media_type == "image":
-                            context.bot.send_photo(chat_id=chat_id, photo=media, caption=response_text or None)
-                        elif media_type == "video":
-                            context.bot.send_video(chat_id=chat_id, video=media, caption=response_text or None)
-                elif response_text:
-                    message.reply_text(response_text)
-            elif response_text:
-                message.reply_text(response_text)
-            return  # Respond only once
-
-def list_filters(update: Update, context: CallbackContext):
-    # Load the latest filters
-    with open(FILTERS_FILE, 'r', encoding='utf-8') as f:
-        filters = json.load(f)
-
-    # Get and sort all triggers alphabetically (removing leading slash only for sorting)
-    sorted_triggers = sorted(filters.keys(), key=lambda k: k.lstrip('/').lower())
-
-    # Re-apply slash only if the original trigger had it
-    formatted_triggers = [f"`{trigger}`" for trigger in sorted_triggers]
-
-    # Telegram messages max out at 4096 characters
-    response = "*Available Filters:*\n" + "\n".join(formatted_triggers)
-    if len(response) > 4000:
-        for i in range(0, len(formatted_triggers), 80):  # 80 items per message chunk
-            chunk = "*Available Filters:*\n" + "\n".join(formatted_triggers[i:i+80])
-            update.message.reply_text(chunk, parse_mode="Markdown")
+    report = metrics.report() if metrics else ""
+    if report:
+        text = f"{report}\n\nCollected {metrics.collected_at()}"
     else:
-        update.message.reply_text(response, parse_mode="Markdown")
+        text = "No metrics collected yet."
+    lines = [f"Log records dropped: {dropped_records()}"]
+    if MODERATION_WORKERS > 0:
+        # the counters live in the workers, this process never sees the traffic
+        lines.append(f"Moderation counters are kept per worker ({MODERATION_WORKERS} workers); /rules shows the rule counters of the worker that handles this chat.")
+    else:
+        lines += moderation_counters()
+    text += "\n\n" + "\n".join(lines)
+    update.message.reply_text(text)
+
+# multi-process mode: hand the update to the worker that owns its chat
+def forward_update(pool, update: Update):
+    chat_id = update.effective_chat.id if update.effective_chat else 0
+    pool.submit(chat_id, update.to_json())
 
 def main():
     updater = Updater(BOT_TOKEN, use_context=True)
@@ -418,15 +145,44 @@ def main():
     job_queue.run_daily(lambda context: post_security_message(context, 0), time=time(hour=8, minute=0))  
     job_queue.run_daily(lambda context: post_security_message(context, 1), time=time(hour=16, minute=0))
     job_queue.run_daily(post_brand_assets, time=time(hour=0, minute=0))
-    job_queue.run_repeating(cleanup_spam_records, interval=60, first=60)
 
-    # Message and command handlers
-    dp.add_handler(CommandHandler("filters", list_filters))
-    dp.add_handler(MessageHandler(Filters.status_update.new_chat_members, handle_new_members))
-    dp.add_handler(MessageHandler(Filters.text | Filters.command, check_message))
+    # profile the first PROFILE_ON_START seconds of polling, results go to the logs
+    if PROFILE_ON_START > 0:
+        profile_in_background(
+            PROFILE_ON_START,
+            lambda summary, path: log_event(logger, logging.INFO, "profile_complete", seconds=PROFILE_ON_START, path=path, summary=summary),
+            top_n=PROFILE_TOP_N,
+        )
+
+    # Metrics run on their own loop thread, sharing this bot's connection
+    metrics = None
+    if METRICS_TIME:
+        hour, minute = map(int, METRICS_TIME.split(':'))
+        metrics = MetricsService(load_collectors(updater.bot, GROUP_CHAT_ID))
+        metrics.start()
+        job_queue.run_daily(lambda context: collect_metrics(metrics, context), time=time(hour=hour, minute=minute))
+
+    # /stats is answered here, from this process's cache, even in multi-process mode. It runs in
+    # COMMANDS_GROUP, after check_message (or after the update is forwarded to a worker).
+    dp.add_handler(CommandHandler("stats", lambda update, context: stats_command(metrics, update, context)), group=COMMANDS_GROUP)
+
+    # Message and command handlers, run here or in worker processes partitioned by chat
+    pool = None
+    if MODERATION_WORKERS > 0:
+        pool = start_telegram_workers(MODERATION_WORKERS, BOT_TOKEN, "moderation.handlers:setup_moderation")
+        dp.add_handler(TypeHandler(Update, lambda update, context: forward_update(pool, update)))
+        log_event(logger, logging.INFO, "workers_started", workers=MODERATION_WORKERS, spam_store=os.environ['SPAM_STORE_PATH'])
+    else:
+        setup_moderation(dp)
 
+    log_event(logger, logging.INFO, "startup_complete", latency_ms=round((perf_counter() - STARTUP_STARTED) * 1000, 1))
     updater.start_polling()
     updater.idle()
 
+    if pool:
+        pool.stop()
+    if metrics:
+        metrics.stop()
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
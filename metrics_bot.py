@@ -1,47 +1,28 @@
-# bot.py
-import asyncio
+# metrics_bot.py
+# One-off metrics run: collects everything once and posts it to the group.
+# bot.py can run the same collection daily (METRICS_TIME) and serves /stats; it only
+# posts with METRICS_POST=1, so use either that or this script for the group post.
 import os
-from api.telegram import get_telegram_stats
-from api.github import get_github_stats
-from api.holders import get_token_stats
-from api.followers import get_x_followers_stats
+from dotenv import load_dotenv
 from telegram import Bot
+from moderation.log import setup_logging
+from moderation.metrics import MetricsService, load_collectors
+
+load_dotenv()  # Load .env vars
+setup_logging()
 
-# Initialize bot using Config
 BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 CHAT_ID = os.getenv("GROUP_CHAT_ID")
 
-bot = Bot(token=BOT_TOKEN)
-
-async def send_update_to_tg(messages):
-    """Sends a combined update message to the Telegram group."""
-    full_message = "\n\n".join(messages)
-    await bot.send_message(chat_id=CHAT_ID, text=full_message)
-
-async def main():
-    # Telegram Metrics
-    telegram_message = await get_telegram_stats()  
-        
-    # GitHub Metrics
-    github_stats = await get_github_stats()  
-
-    # Holders Metrics
-    token_stats = await get_token_stats()
-
-    # Followers Metrics
-    x_followers_stats = await get_x_followers_stats()
-
-    # Create a list of messages
-    messages = [
-        github_stats,
-        telegram_message,       
-        token_stats,
-        x_followers_stats        
-    ]
-    
-    # Send all metrics together in one message
-    await send_update_to_tg(messages)
+def main():
+    bot = Bot(token=BOT_TOKEN)
+    metrics = MetricsService(load_collectors(bot, CHAT_ID))
+    metrics.start()
+    try:
+        # Send all metrics together in one message
+        metrics.collect(lambda text: bot.send_message(chat_id=CHAT_ID, text=text)).result()
+    finally:
+        metrics.stop()
 
 if __name__ == "__main__":
-    # Use asyncio.run() to start the async main function
-    asyncio.run(main())
\ No newline at end of file
+    main()
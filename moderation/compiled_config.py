@@ -0,0 +1,250 @@
+"""Compiled moderation config.
+
+All moderation inputs (phrase lists, filters.json, rules.json and the media folder) are
+parsed once into a single pickled artifact keyed by a hash of their contents.
+At startup the artifact is loaded as-is when the hash still matches, and
+rebuilt (and rewritten) only when a source file changed. Either way every
+matcher is then compiled before the config is returned, so no regex compilation
+happens on the message path.
+
+Build it ahead of time, e.g. in the deploy build step:
+
+    python -m moderation.compiled_config
+"""
+import os
+import re
+import json
+import pickle
+import logging
+import hashlib
+from time import perf_counter
+
+from moderation.log import get_logger, log_event
+
+logger = get_logger(__name__)
+
+# Bump whenever the layout of CompiledConfig changes
+ARTIFACT_VERSION = 2
+ARTIFACT_FILE = "data/compiled_config.pickle"
+
+# Source files
+FILTERS_FILE = "filters/filters.json"
+MEDIA_FOLDER = "media"
+BAN_PHRASES_FILE = "blocklists/ban_phrases.txt"
+MUTE_PHRASES_FILE = "blocklists/mute_phrases.txt"
+DELETE_PHRASES_FILE = "blocklists/delete_phrases.txt"
+WHITELIST_PHRASES_FILE = "whitelists/whitelist_phrases.txt"
+RULES_FILE = "filters/rules.json"
+
+SOURCE_FILES = [
+    FILTERS_FILE,
+    BAN_PHRASES_FILE,
+    MUTE_PHRASES_FILE,
+    DELETE_PHRASES_FILE,
+    WHITELIST_PHRASES_FILE,
+    RULES_FILE,
+]
+
+# Load filters as dict
+def load_filters(file_path):
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+# Load blocklist/whitelisted words/phrases from files
+def load_phrases(file_path):
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return [line.strip().lower() for line in file.readlines()]
+
+def trigger_pattern(trigger):
+    """Regex source for a filter trigger: word boundaries, optional leading slash, optional _suffix."""
+    return rf'(?<!\w)/?{re.escape(trigger.strip().lower())}(_\w+)?(?!\w)'
+
+def phrases_pattern(phrases):
+    """Regex source matching any phrase of the list as a whole word, or None if the list is empty.
+
+    `\\b(?:a|b)\\b` matches exactly when one of `\\ba\\b`, `\\bb\\b` does, so a single
+    search replaces one search per phrase.
+    """
+    if not phrases:
+        return None
+    return r'\b(?:' + '|'.join(re.escape(phrase) for phrase in phrases) + r')\b'
+
+class CompiledConfig:
+    """Everything check_message needs, pre-parsed, with the sources of its matchers.
+
+    Only plain data is pickled. Compiled regexes can't be serialised (unpickling a
+    pattern recompiles it), so the artifact holds pattern sources and compile_all()
+    builds the matchers once after loading.
+    """
+
+    def __init__(self, source_hash, filters, ban_phrases, mute_phrases, delete_phrases, whitelist_phrases, media_files, rules):
+        self.version = ARTIFACT_VERSION
+        self.source_hash = source_hash
+
+        self.filters = filters
+        self.ban_phrases = ban_phrases
+        self.mute_phrases = mute_phrases
+        self.delete_phrases = delete_phrases
+        self.whitelist_phrases = whitelist_phrases
+        self.whitelist = frozenset(whitelist_phrases)
+
+        # moderation rule settings, see moderation/rules.py
+        self.rules = rules
+
+        # phrase matchers
+        self.sources = {
+            "ban": phrases_pattern(ban_phrases),
+            "mute": phrases_pattern(mute_phrases),
+            "delete": phrases_pattern(delete_phrases),
+            "any_trigger": '|'.join(f'(?:{trigger_pattern(trigger)})' for trigger in filters) or None,
+        }
+
+        # trigger index, kept in filters.json order so the first listed trigger wins
+        self.triggers = {trigger: trigger_pattern(trigger) for trigger in filters}
+
+        # media manifest: trigger -> media path, only for media files that exist on disk
+        self.media = {}
+        for trigger, filter_data in filters.items():
+            media_file = filter_data.get("media")
+            if media_file and media_file in media_files:
+                self.media[trigger] = os.path.join(MEDIA_FOLDER, media_file)
+
+        self._compiled = {}
+        self._compiled_triggers = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_compiled"] = {}
+        state["_compiled_triggers"] = {}
+        return state
+
+    def compile_all(self):
+        """Compiles every phrase and trigger pattern up front, returns how many were compiled."""
+        for key in self.sources:
+            self.pattern(key)
+        for trigger in self.triggers:
+            self.trigger(trigger)
+        return len(self._compiled) + len(self._compiled_triggers)
+
+    def pattern(self, key):
+        """Compiled pattern for "ban", "mute", "delete" or "any_trigger", or None if the list is empty."""
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            source = self.sources[key]
+            if source is None:
+                return None
+            compiled = self._compiled[key] = re.compile(source)
+        return compiled
+
+    def trigger(self, trigger):
+        """Compiled pattern for a single filter trigger."""
+        compiled = self._compiled_triggers.get(trigger)
+        if compiled is None:
+            compiled = self._compiled_triggers[trigger] = re.compile(self.triggers[trigger])
+        return compiled
+
+    def match_phrase(self, key, text):
+        """Returns the first "ban", "mute" or "delete" phrase found in text, or None."""
+        pattern = self.pattern(key)
+        if pattern is None:
+            return None
+        match = pattern.search(text)
+        return match.group(0) if match else None
+
+    def match_trigger(self, text):
+        """Returns the first filter trigger (in filters.json order) found in text, or None."""
+        any_trigger = self.pattern("any_trigger")
+        if any_trigger is None or not any_trigger.search(text):
+            return None
+        for trigger in self.triggers:
+            if self.trigger(trigger).search(text):
+                return trigger
+        return None
+
+def list_media_files(media_folder=MEDIA_FOLDER):
+    if not os.path.isdir(media_folder):
+        return []
+    return sorted(name for name in os.listdir(media_folder) if os.path.isfile(os.path.join(media_folder, name)))
+
+def compute_source_hash(root="."):
+    """Hashes the artifact version, every source file and the media folder listing."""
+    digest = hashlib.sha256(f"v{ARTIFACT_VERSION}".encode())
+    for path in SOURCE_FILES:
+        digest.update(path.encode())
+        with open(os.path.join(root, path), 'rb') as f:
+            digest.update(f.read())
+    for name in list_media_files(os.path.join(root, MEDIA_FOLDER)):
+        digest.update(f"{MEDIA_FOLDER}/{name}".encode())
+    return digest.hexdigest()
+
+def build_config(source_hash=None, root="."):
+    """Parses every source file under root and builds the matchers."""
+    return CompiledConfig(
+        source_hash=source_hash or compute_source_hash(root),
+        filters=load_filters(os.path.join(root, FILTERS_FILE)),
+        ban_phrases=load_phrases(os.path.join(root, BAN_PHRASES_FILE)),
+        mute_phrases=load_phrases(os.path.join(root, MUTE_PHRASES_FILE)),
+        delete_phrases=load_phrases(os.path.join(root, DELETE_PHRASES_FILE)),
+        whitelist_phrases=load_phrases(os.path.join(root, WHITELIST_PHRASES_FILE)),
+        media_files=set(list_media_files(os.path.join(root, MEDIA_FOLDER))),
+        rules=load_filters(os.path.join(root, RULES_FILE)),
+    )
+
+def read_artifact(source_hash, artifact_path=ARTIFACT_FILE):
+    """Returns the cached config if it exists and matches source_hash, otherwise None."""
+    if not os.path.exists(artifact_path):
+        return None
+    try:
+        with open(artifact_path, 'rb') as f:
+            config = pickle.load(f)
+    except Exception as e:
+        log_event(logger, logging.WARNING, "config_artifact_unreadable", path=artifact_path, error=str(e))
+        return None
+    if getattr(config, "version", None) != ARTIFACT_VERSION or getattr(config, "source_hash", None) != source_hash:
+        return None
+    return config
+
+def write_artifact(config, artifact_path=ARTIFACT_FILE):
+    """Writes the artifact atomically so a crashed write never leaves a half file behind."""
+    try:
+        os.makedirs(os.path.dirname(artifact_path) or ".", exist_ok=True)
+        tmp_path = f"{artifact_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(config, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, artifact_path)
+    except OSError as e:
+        log_event(logger, logging.ERROR, "config_artifact_write_failed", path=artifact_path, error=str(e))
+
+def load_compiled_config(artifact_path=ARTIFACT_FILE):
+    """Loads the cached config, rebuilding it only when the source hash changed, and compiles its matchers."""
+    started = perf_counter()
+    source_hash = compute_source_hash()
+    config = read_artifact(source_hash, artifact_path)
+    rebuilt = config is None
+    if rebuilt:
+        config = build_config(source_hash)
+        write_artifact(config, artifact_path)
+    loaded = perf_counter()
+    patterns = config.compile_all()
+    finished = perf_counter()
+    log_event(
+        logger, logging.INFO, "config_loaded",
+        rebuilt=rebuilt,
+        latency_ms=round((finished - started) * 1000, 1),
+        load_ms=round((loaded - started) * 1000, 1),
+        compile_ms=round((finished - loaded) * 1000, 1),
+        patterns=patterns,
+        source_hash=source_hash[:12],
+    )
+    return config
+
+if __name__ == '__main__':
+    # build through the importable module so the pickle references moderation.compiled_config, not __main__
+    from moderation import compiled_config
+
+    started = perf_counter()
+    config = compiled_config.build_config()
+    compiled_config.write_artifact(config)
+    print(f"[CONFIG] Built {ARTIFACT_FILE} in {(perf_counter() - started) * 1000:.1f} ms "
+          f"(hash {config.source_hash[:12]}, {len(config.filters)} filters, "
+          f"{len(config.ban_phrases) + len(config.mute_phrases) + len(config.delete_phrases)} phrases)")
@@ -0,0 +1,416 @@
+"""Moderation handlers and the state they share.
+
+Everything here runs wherever updates are handled: in the bot process, or in
+each worker process in multi-process mode (see moderation/workers.py). Importing
+the module is cheap. The config, spam store, throttle and rule engine are only
+built by setup_moderation(), so the ingest process, which just forwards updates,
+never builds them, and spawned workers build them once.
+"""
+import os
+import html
+import json
+import logging
+from time import perf_counter
+from datetime import datetime, timedelta, timezone
+from telegram import Update, ChatPermissions, ParseMode
+from telegram.ext import MessageHandler, Filters, CallbackContext, CommandHandler, DispatcherHandlerStop
+
+from moderation.log import dropped_records, get_logger, log_event
+from moderation.compiled_config import FILTERS_FILE, load_compiled_config
+from moderation.throttle import ResponseThrottle
+from moderation.spam_store import MemorySpamStore, create_spam_store
+from moderation.profiling import deep_sizeof, process_rss_bytes, profile_in_background
+from moderation.rules import BAN, DELETE, MUTE, MUTE_SPAMMERS, SUSPICIOUS_USERNAMES, MessageFacts, build_checks, build_engine
+
+logger = get_logger(__name__)
+
+# Mute duration in seconds (3 days)
+MUTE_DURATION = 3 * 24 * 60 * 60
+
+# auto spam detection variables
+SPAM_THRESHOLD = 3
+TIME_WINDOW = timedelta(seconds=15)
+SPAM_RECORD_DURATION = timedelta(minutes=5) # flagged spam messages are remembered for 5 minutes
+
+# Profiling: /profile <seconds> for admins
+DEFAULT_PROFILE_SECONDS = 30
+MAX_PROFILE_SECONDS = 300
+PROFILE_TOP_N = 20
+
+# Admin commands are handled in a later group than check_message. Only the first matching
+# handler of a group runs, so a command in group 0 would let "/rules <spam>" skip moderation.
+# check_message stops the update once it acts on a message, so these never run for it.
+# /filters stays in group 0 ahead of check_message, as it always was: it is answered, not moderated.
+COMMANDS_GROUP = 1
+
+# Set by setup_moderation(); settings are read then, after bot.py has loaded .env
+GROUP_CHAT_ID = None
+MEMORY_SNAPSHOT_INTERVAL = 600
+SPAM_LOG_SAMPLE_RATE = 0.01
+ALLOWED_LOG_SAMPLE_RATE = 0.01
+CONFIG = None
+FILTERS = None
+RESPONSE_THROTTLE = None
+SPAM_STORE = None
+RULE_ENGINE = None
+
+def init_state():
+    """Reads the settings and builds the shared moderation state, once per process."""
+    global GROUP_CHAT_ID, MEMORY_SNAPSHOT_INTERVAL, SPAM_LOG_SAMPLE_RATE, ALLOWED_LOG_SAMPLE_RATE
+    global CONFIG, FILTERS, RESPONSE_THROTTLE, SPAM_STORE, RULE_ENGINE
+    if CONFIG is not None:
+        return
+
+    GROUP_CHAT_ID = os.getenv('GROUP_CHAT_ID')
+
+    # Seconds between memory snapshots of the long-lived structures (0 = off)
+    MEMORY_SNAPSHOT_INTERVAL = int(os.getenv('MEMORY_SNAPSHOT_INTERVAL', '600'))
+
+    # Fraction of high-volume debug events that get logged
+    SPAM_LOG_SAMPLE_RATE = float(os.getenv('SPAM_LOG_SAMPLE_RATE', '0.01'))
+    ALLOWED_LOG_SAMPLE_RATE = float(os.getenv('ALLOWED_LOG_SAMPLE_RATE', '0.01'))
+
+    # Filters, phrase lists and their compiled matchers (see moderation/compiled_config.py)
+    CONFIG = load_compiled_config()
+    FILTERS = CONFIG.filters
+
+    # Filter response throttling (per-trigger limits live in filters.json, see moderation/throttle.py)
+    RESPONSE_THROTTLE = ResponseThrottle(FILTERS)
+
+    # Spam window storage: in memory, or SQLite when SPAM_STORE_PATH is set (always set with workers)
+    SPAM_STORE = create_spam_store(SPAM_THRESHOLD, TIME_WINDOW, SPAM_RECORD_DURATION, os.getenv('SPAM_STORE_PATH'))
+
+    # Moderation rules (order, cost and actions live in filters/rules.json, see moderation/rules.py)
+    RULE_ENGINE = build_engine(
+        CONFIG.rules,
+        build_checks(CONFIG, SUSPICIOUS_USERNAMES, spam_check),
+        adaptive=os.getenv('RULES_ADAPTIVE', '').lower() in ('1', 'true', 'yes'),
+    )
+
+def get_admin_ids(context, chat_id):
+    # Fetch chat admins dynamically
+    chat_admins = context.bot.get_chat_administrators(chat_id)
+    return [admin.user.id for admin in chat_admins]
+
+# check for spam
+def check_for_spam(message_text, user_id):
+    now = datetime.now(timezone.utc)
+    # track user and timestamp of the message
+    # entries for this text within the time window, flagged as spam in the store once over the threshold
+    recent = SPAM_STORE.record(message_text, user_id, now)
+
+    log_event(logger, logging.DEBUG, "spam_check", sample_rate=SPAM_LOG_SAMPLE_RATE, user=user_id, recent=len(recent), text=message_text)
+
+    # If recent messages exceed the threshold, flag as spam
+    if len(recent) >= SPAM_THRESHOLD:
+        spammer_ids = list(set([entry[0] for entry in recent])) # Return list of user_ids to mute
+        log_event(logger, logging.INFO, "spam_detected", users=spammer_ids, text=message_text)
+        return spammer_ids
+
+    return []
+
+# check for recent spam and mute spammers
+def check_recent_spam(message_text):
+    now = datetime.now(timezone.utc)
+    is_spam = SPAM_STORE.is_recent_spam(message_text, now)
+    if is_spam:
+        log_event(logger, logging.INFO, "spam_recent", text=message_text)
+    return is_spam
+
+# clean up spam records
+def cleanup_spam_records(context: CallbackContext):
+    now = datetime.now(timezone.utc)
+    expired_messages = SPAM_STORE.cleanup(now)
+
+    if expired_messages:
+        log_event(logger, logging.INFO, "spam_records_expired", count=len(expired_messages))
+
+# spam rule: users to mute for the copy-paste wave this message belongs to
+def spam_check(facts):
+    spammer_ids = check_for_spam(facts.text, facts.user_id)
+
+    if check_recent_spam(facts.text) and facts.user_id not in spammer_ids:
+        spammer_ids.append(facts.user_id)
+
+    return spammer_ids
+
+# Suspicious auto-ban function
+def handle_new_members(update, context):
+    message = update.message
+    if message is None or not message.new_chat_members:
+        return
+
+    chat_id = message.chat.id
+
+    for new_user in message.new_chat_members:
+        name = new_user.full_name or "No Name"
+        username = new_user.username or "No Username"
+        user_id = new_user.id
+
+        name_info = f"Name: {name}, Username: @{username}" if new_user.username else f"Name: {name} (no username)"
+        log_event(logger, logging.INFO, "member_joined", chat=chat_id, user=user_id, name=name_info)
+
+        name_lower = name.lower()
+        username_lower = username.lower()
+
+        if any(keyword in name_lower or keyword in username_lower for keyword in SUSPICIOUS_USERNAMES):
+            try:
+                context.bot.ban_chat_member(chat_id, user_id)
+                log_event(logger, logging.INFO, "member_banned", chat=chat_id, user=user_id, rule="suspicious_name", action="ban", name=name_info)
+            except Exception as e:
+                log_event(logger, logging.ERROR, "member_ban_failed", chat=chat_id, user=user_id, error=str(e))
+
+def check_message(update: Update, context: CallbackContext):
+    started = perf_counter()
+    message = update.message or update.channel_post  # Handle both messages and channel posts
+    if not message:
+        log_event(logger, logging.DEBUG, "no_message")
+        return
+
+    message_text = message.text.lower()
+    chat_id = update.effective_chat.id
+    user_id = update.effective_user.id
+    user = update.effective_user
+
+    # Fetch chat admins to prevent acting on their messages
+    chat_admins = context.bot.get_chat_administrators(chat_id)
+    admin_ids = [admin.user.id for admin in chat_admins]
+
+    # If the message starts with /say, the bot will send a message on behalf of the admin
+    if message_text.startswith('/say '):
+        # Ensure the user is an admin (using admin_ids already fetched)
+        if user_id in admin_ids:
+            # Get the message after the /say command
+            say_message = message_text[len('/say '):].strip()
+
+            # Ensure the message is not empty
+            if say_message:
+                context.bot.delete_message(chat_id=chat_id, message_id=message.message_id)
+                # Send the message as the bot
+                context.bot.send_message(
+                    chat_id=chat_id,
+                    text=say_message,
+                    parse_mode=ParseMode.HTML  # If you want to support HTML formatting
+                )
+            else:
+                log_event(logger, logging.INFO, "say_empty", chat=chat_id, user=user_id)
+            return  # After processing /say, exit the function
+
+    # Ignore messages from admins
+    if user_id not in admin_ids:
+        facts = MessageFacts(
+            text=message_text,
+            raw_text=message.text,
+            user_id=user_id,
+            full_name=user.full_name,
+            username=user.username,
+            is_forward=bool(message.forward_date or message.forward_from or message.forward_from_chat),
+        )
+        decision = RULE_ENGINE.evaluate(facts)
+        latency_ms = round((perf_counter() - started) * 1000, 2)
+        if decision:
+            log_event(logger, logging.INFO, "rule_hit", chat=chat_id, user=user_id, rule=decision.rule.name,
+                      action=decision.action, latency_ms=latency_ms, detail=decision.detail, text=message_text)
+            apply_decision(decision, message, user, context)
+            # the message was acted on, don't run commands in later groups for it
+            raise DispatcherHandlerStop()
+        log_event(logger, logging.DEBUG, "message_allowed", sample_rate=ALLOWED_LOG_SAMPLE_RATE, chat=chat_id,
+                  user=user_id, latency_ms=latency_ms)
+
+    # Filter Responses (apply to all, throttled per trigger and per chat)
+    trigger = CONFIG.match_trigger(message_text)
+    if trigger:
+        throttle_decision, delay = RESPONSE_THROTTLE.request(chat_id, trigger, message)
+        if throttle_decision == ResponseThrottle.SEND:
+            send_filter_response(context.bot, chat_id, trigger, message)
+        else:
+            log_event(logger, logging.INFO, "response_throttled", chat=chat_id, user=user_id, trigger=trigger,
+                      suppressed=RESPONSE_THROTTLE.suppressed[trigger])
+            if throttle_decision == ResponseThrottle.SCHEDULE:
+                context.job_queue.run_once(flush_filter_response, delay, context=(chat_id, trigger))
+
+# carry out a moderation rule's decision on a message
+def apply_decision(decision, message, user, context: CallbackContext):
+    rule = decision.rule
+    chat_id = message.chat_id
+
+    if rule.action == DELETE:
+        context.bot.delete_message(chat_id=chat_id, message_id=message.message_id)
+
+    elif rule.action == BAN:
+        context.bot.ban_chat_member(chat_id=chat_id, user_id=user.id)
+
+    elif rule.action == MUTE:
+        until_date = message.date + timedelta(seconds=MUTE_DURATION)
+        permissions = ChatPermissions(can_send_messages=False)
+        context.bot.restrict_chat_member(chat_id=chat_id, user_id=user.id, permissions=permissions, until_date=until_date)
+
+    elif rule.action == MUTE_SPAMMERS:
+        for spammer_id in set(decision.detail):
+            try:
+                until_date = message.date + timedelta(seconds=MUTE_DURATION)
+                permissions = ChatPermissions(can_send_messages=False)
+                context.bot.restrict_chat_member(chat_id=chat_id, user_id=spammer_id, permissions=permissions, until_date=until_date)
+                log_event(logger, logging.INFO, "spammer_muted", chat=chat_id, user=spammer_id, rule=rule.name, action=rule.action)
+            except Exception as e:
+                log_event(logger, logging.ERROR, "spammer_mute_failed", chat=chat_id, user=spammer_id, error=str(e))
+
+    if rule.reply:
+        message.reply_text(rule.reply.format(first_name=user.first_name))
+
+def send_filter_response(bot, chat_id, trigger, message, quote=False):
+    filter_data = FILTERS[trigger]
+    response_text = filter_data.get("response_text", "")
+    media_type = filter_data.get("type", "gif").lower()
+    # coalesced responses reply to the latest asker, media included
+    reply_to_message_id = message.message_id if quote else None
+
+    # media manifest only lists media files that exist on disk
+    media_path = CONFIG.media.get(trigger)
+    if media_path:
+        with open(media_path, 'rb') as media:
+            if media_type in ["gif", "animation"]:
+                bot.send_animation(chat_id=chat_id, animation=media, caption=response_text or None, reply_to_message_id=reply_to_message_id)
+            elif media_type == "image":
+                bot.send_photo(chat_id=chat_id, photo=media, caption=response_text or None, reply_to_message_id=reply_to_message_id)
+            elif media_type == "video":
+                bot.send_video(chat_id=chat_id, video=media, caption=response_text or None, reply_to_message_id=reply_to_message_id)
+    elif response_text:
+        message.reply_text(response_text)
+
+# send one coalesced filter response once the throttle buckets refill
+def flush_filter_response(context: CallbackContext):
+    chat_id, trigger = context.job.context
+    message, delay = RESPONSE_THROTTLE.flush(chat_id, trigger)
+    if message is not None:
+        try:
+            send_filter_response(context.bot, chat_id, trigger, message, quote=True)
+        except Exception as e:
+            log_event(logger, logging.ERROR, "coalesced_response_failed", chat=chat_id, trigger=trigger, error=str(e))
+    elif delay:
+        context.job_queue.run_once(flush_filter_response, delay, context=(chat_id, trigger))
+
+# drop idle throttle buckets
+def cleanup_response_throttle(context: CallbackContext):
+    RESPONSE_THROTTLE.prune()
+
+def list_filters(update: Update, context: CallbackContext):
+    # Load the latest filters
+    with open(FILTERS_FILE, 'r', encoding='utf-8') as f:
+        filters = json.load(f)
+
+    # Get and sort all triggers alphabetically (removing leading slash only for sorting)
+    sorted_triggers = sorted(filters.keys(), key=lambda k: k.lstrip('/').lower())
+
+    # Re-apply slash only if the original trigger had it
+    formatted_triggers = [f"`{trigger}`" for trigger in sorted_triggers]
+
+    # Telegram messages max out at 4096 characters
+    response = "*Available Filters:*\n" + "\n".join(formatted_triggers)
+    if len(response) > 4000:
+        for i in range(0, len(formatted_triggers), 80):  # 80 items per message chunk
+            chunk = "*Available Filters:*\n" + "\n".join(formatted_triggers[i:i+80])
+            update.message.reply_text(chunk, parse_mode="Markdown")
+    else:
+        update.message.reply_text(response, parse_mode="Markdown")
+
+# admin-only: per-rule hit rates and timings
+def rule_stats(update: Update, context: CallbackContext):
+    if update.effective_user.id not in get_admin_ids(context, GROUP_CHAT_ID):
+        return
+
+    lines = [f"*Rules* ({'adaptive' if RULE_ENGINE.adaptive else 'static'} order, {RULE_ENGINE.evaluations} messages)"]
+    for stats in RULE_ENGINE.stats():
+        lines.append(
+            f"`{stats['rule']}` p{stats['priority']}: {stats['hits']}/{stats['evaluations']} hits "
+            f"({stats['hit_rate']:.1%}), {stats['avg_us']:.0f}µs avg"
+        )
+    update.message.reply_text("\n".join(lines), parse_mode="Markdown")
+
+# admin-only: sample every thread for /profile <seconds> and DM the hottest functions.
+# In multi-process mode this profiles the worker that owns the chat the command was sent in.
+def profile_command(update: Update, context: CallbackContext):
+    user_id = update.effective_user.id
+    if user_id not in get_admin_ids(context, GROUP_CHAT_ID):
+        return
+
+    try:
+        seconds = int(context.args[0]) if context.args else DEFAULT_PROFILE_SECONDS
+    except ValueError:
+        update.message.reply_text("Usage: /profile <seconds>")
+        return
+    seconds = max(1, min(seconds, MAX_PROFILE_SECONDS))
+
+    def send_result(summary, path):
+        log_event(logger, logging.INFO, "profile_complete", user=user_id, seconds=seconds, path=path)
+        text = f"<b>Profile ({seconds}s)</b>\nRaw stats: <code>{html.escape(path)}</code>\n<pre>{html.escape(summary[:3500])}</pre>"
+        try:
+            context.bot.send_message(chat_id=user_id, text=text, parse_mode=ParseMode.HTML)
+        except Exception as e:
+            log_event(logger, logging.ERROR, "profile_dm_failed", user=user_id, error=str(e))
+
+    if profile_in_background(seconds, send_result, top_n=PROFILE_TOP_N):
+        update.message.reply_text(f"Profiling for {seconds}s, results will be sent by DM.")
+    else:
+        update.message.reply_text("A profile is already running.")
+
+def counter_lines(title, counter, top_n=10):
+    lines = [f"{title}: {sum(counter.values())}"]
+    lines += [f"  {key}: {count}" for key, count in counter.most_common(top_n)]
+    return lines
+
+# moderation counters for /stats, empty when this process doesn't handle updates (multi-process ingest)
+def moderation_counters():
+    if RULE_ENGINE is None:
+        return []
+    return [
+        f"Messages checked: {RULE_ENGINE.evaluations}",
+        *counter_lines("Filter responses suppressed", RESPONSE_THROTTLE.suppressed),
+        *counter_lines("Coalesced replies sent", RESPONSE_THROTTLE.coalesced),
+    ]
+
+# structures that live for the whole process, watched for unbounded growth
+def memory_structures():
+    structures = {
+        "filters": FILTERS,
+        "phrases": (CONFIG.ban_phrases, CONFIG.mute_phrases, CONFIG.delete_phrases, CONFIG.whitelist_phrases),
+        "throttle_buckets": (RESPONSE_THROTTLE.trigger_buckets, RESPONSE_THROTTLE.chat_buckets),
+    }
+    if isinstance(SPAM_STORE, MemorySpamStore):
+        structures["spam_tracker"] = SPAM_STORE.tracker
+        structures["spam_records"] = SPAM_STORE.records
+    return structures
+
+# job: sizes of this process's moderation structures (one snapshot per worker in multi-process mode)
+def memory_snapshot(context: CallbackContext):
+    sizes = {}
+    for name, structure in memory_structures().items():
+        try:
+            sizes[f"{name}_bytes"] = deep_sizeof(structure)
+        except RuntimeError:
+            # changed size while being measured by the dispatcher thread, skip this round
+            sizes[f"{name}_bytes"] = None
+    log_event(
+        logger, logging.INFO, "memory_snapshot",
+        pid=os.getpid(),
+        rss_bytes=process_rss_bytes(),
+        throttle_pending=len(RESPONSE_THROTTLE.pending),
+        log_dropped=dropped_records(),
+        **SPAM_STORE.sizes(),
+        **sizes,
+    )
+
+def setup_moderation(dp):
+    """Builds the moderation state, registers the handlers and schedules the moderation jobs on dp."""
+    init_state()
+
+    dp.add_handler(CommandHandler("filters", list_filters))
+    dp.add_handler(MessageHandler(Filters.status_update.new_chat_members, handle_new_members))
+    dp.add_handler(MessageHandler(Filters.text | Filters.command, check_message))
+    dp.add_handler(CommandHandler("rules", rule_stats), group=COMMANDS_GROUP)
+    dp.add_handler(CommandHandler("profile", profile_command), group=COMMANDS_GROUP)
+
+    dp.job_queue.run_repeating(cleanup_spam_records, interval=60, first=60)
+    dp.job_queue.run_repeating(cleanup_response_throttle, interval=300, first=300)
+    if MEMORY_SNAPSHOT_INTERVAL > 0:
+        dp.job_queue.run_repeating(memory_snapshot, interval=MEMORY_SNAPSHOT_INTERVAL, first=MEMORY_SNAPSHOT_INTERVAL)
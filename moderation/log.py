@@ -0,0 +1,136 @@
+"""Structured, non-blocking logging.
+
+Records are JSON lines with a fixed set of fields (event, chat, user, rule, action,
+latency_ms, ...). Handlers only put records on a bounded queue; a background
+listener thread formats and writes them, so a slow stdout never stalls update
+handling. When the queue is full, records are dropped and counted rather than
+blocking.
+
+    from moderation.log import get_logger, log_event
+    logger = get_logger(__name__)
+    log_event(logger, logging.INFO, "rule_hit", chat=chat_id, user=user_id, rule="spam", action="mute")
+    log_event(logger, logging.DEBUG, "spam_check", sample_rate=0.01, text=message_text)
+
+Settings (environment):
+    LOG_LEVEL        minimum level, default INFO
+    LOG_REDACT_TEXT  1 to replace message text and user name fields with their length
+    LOG_REDACT_KEY   secret for redacted fields: adds a keyed hash, so repeats of the same
+                     text can be matched up without the text being recoverable from the logs
+    LOG_QUEUE_SIZE   records buffered before dropping, default 10000
+"""
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import hmac
+import hashlib
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+
+# Fields that hold user-written text (messages, display names), redacted with LOG_REDACT_TEXT
+TEXT_FIELDS = {"text", "phrase", "detail", "name"}
+
+_listener = None
+
+def redact(value, key=None):
+    # a plain hash of a short text or name can be brute-forced, so without a key only the length is kept
+    value = str(value)
+    if not key:
+        return f"<redacted len={len(value)}>"
+    digest = hmac.new(key, value.encode(), hashlib.sha256).hexdigest()[:16]
+    return f"<redacted len={len(value)} hmac={digest}>"
+
+class JsonFormatter(logging.Formatter):
+
+    def __init__(self, redact_text=False, redact_key=None):
+        super().__init__()
+        self.redact_text = redact_text
+        self.redact_key = redact_key
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        for key, value in getattr(record, "fields", {}).items():
+            if value is None:
+                continue
+            entry[key] = redact(value, self.redact_key) if self.redact_text and key in TEXT_FIELDS else value
+        sample_rate = getattr(record, "sample_rate", 1.0)
+        if sample_rate < 1.0:
+            entry["sample_rate"] = sample_rate
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops (and counts) records instead of raising when the queue is full."""
+
+    def __init__(self, record_queue):
+        super().__init__(record_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # formatting happens on the listener thread; only freeze args/exc_info here
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def setup_logging(stream=None):
+    """Routes all logging through a queue to a JSON stream handler. Safe to call more than once."""
+    global _listener
+    if _listener is not None:
+        return
+
+    level = os.getenv("LOG_LEVEL", "INFO").upper()
+    redact_text = os.getenv("LOG_REDACT_TEXT", "").lower() in ("1", "true", "yes")
+    redact_key = os.getenv("LOG_REDACT_KEY", "").encode() or None
+    record_queue = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter(redact_text=redact_text, redact_key=redact_key))
+
+    root = logging.getLogger()
+    root.handlers[:] = [DroppingQueueHandler(record_queue)]
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(record_queue, output, respect_handler_level=False)
+    _listener.start()
+    atexit.register(stop_logging)
+
+def stop_logging():
+    """Flushes queued records and stops the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def dropped_records():
+    return sum(getattr(handler, "dropped", 0) for handler in logging.getLogger().handlers)
+
+def get_logger(name):
+    return logging.getLogger(name)
+
+def log_event(logger, level, event, sample_rate=1.0, exc_info=None, **fields):
+    """Logs a structured event. With sample_rate < 1, only that fraction of calls is logged."""
+    if not logger.isEnabledFor(level):
+        return
+    if sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+    logger.log(level, event, exc_info=exc_info, extra={"fields": fields, "sample_rate": sample_rate})
@@ -0,0 +1,150 @@
+"""Community metrics collected inside the bot process.
+
+The collectors in api/ (GitHub, Telegram members, token holders, X followers) run
+as coroutines on one long-lived asyncio loop in a background thread. They share a
+single aiohttp session and the bot's own Telegram connection. Job queue callbacks
+only submit a run to that loop and return, so a slow API never holds up the job
+queue or update handling. The latest result of every collector is kept for /stats,
+and also written to data/metrics_latest.json so it is still there after a restart.
+A run only posts what it collected itself; /stats marks older results as stale.
+"""
+import asyncio
+import logging
+import importlib
+import threading
+from time import perf_counter
+from datetime import datetime, timezone
+
+from api.store import JsonStore
+from moderation.log import get_logger, log_event
+
+logger = get_logger(__name__)
+
+LATEST_FILE = "data/metrics_latest.json"
+
+# Seconds a single collector may take before its run is abandoned
+COLLECT_TIMEOUT = 300
+
+def load_collectors(bot, chat_id):
+    """(name, collector) pairs in report order. A collector is called as collector(session).
+
+    Collectors whose dependencies (aiohttp, playwright) aren't installed are left out.
+    """
+    collectors = []
+
+    def add(name, module_name, build):
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError as e:
+            log_event(logger, logging.WARNING, "metrics_collector_unavailable", collector=name, error=str(e))
+            return
+        collectors.append((name, build(module)))
+
+    add("github", "api.github", lambda module: module.get_github_stats)
+    add("telegram", "api.telegram", lambda module: lambda session: module.get_telegram_stats(bot, chat_id))
+    add("holders", "api.holders", lambda module: module.get_token_stats)
+    add("followers", "api.followers", lambda module: lambda session: module.get_x_followers_stats())
+    return collectors
+
+class MetricsService:
+
+    def __init__(self, collectors, latest_file=LATEST_FILE):
+        self.collectors = collectors
+        self.store = JsonStore(latest_file)
+        self.latest = {}    # collector name -> {"text": ..., "collected_at": ...}
+        self.fresh = set()  # collectors the latest run refreshed, the rest of latest is older
+        self.loop = None
+        self.session = None
+        self.thread = None
+        self.running = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Starts the metrics loop thread and loads the results saved by the previous process."""
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="metrics-loop", daemon=True)
+        self.thread.start()
+        self.latest = asyncio.run_coroutine_threadsafe(self.store.load({}), self.loop).result()
+
+    def stop(self, timeout=10):
+        if self.loop is None:
+            return
+        if self.session is not None:
+            asyncio.run_coroutine_threadsafe(self.session.close(), self.loop).result(timeout)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+        self.loop = None
+
+    def open_session(self):
+        # one connection pool for every HTTP collector; collectors that only use the bot don't need aiohttp
+        if self.session is None:
+            try:
+                import aiohttp
+            except ImportError:
+                return None
+            self.session = aiohttp.ClientSession()
+        return self.session
+
+    async def collect_one(self, name, collector, session):
+        started = perf_counter()
+        try:
+            text = await asyncio.wait_for(collector(session), COLLECT_TIMEOUT)
+        except Exception as e:
+            log_event(logger, logging.ERROR, "metrics_collect_failed", collector=name, error=str(e))
+            return False
+        self.latest[name] = {"text": text, "collected_at": datetime.now(timezone.utc).isoformat(timespec="seconds")}
+        log_event(logger, logging.INFO, "metrics_collected", collector=name, latency_ms=round((perf_counter() - started) * 1000, 1))
+        return True
+
+    async def collect_all(self, on_report):
+        session = self.open_session()
+        collected = await asyncio.gather(*(self.collect_one(name, collector, session) for name, collector in self.collectors))
+        self.fresh = {name for (name, _), ok in zip(self.collectors, collected) if ok}
+        await self.store.save(self.latest)
+        if on_report is None:
+            return
+        if not self.fresh:
+            log_event(logger, logging.WARNING, "metrics_report_skipped", reason="every collector failed")
+            return
+        # only this run's results are posted; on_report makes blocking bot calls, keep them off the loop
+        await asyncio.get_running_loop().run_in_executor(None, on_report, self.report(self.fresh))
+
+    def collect(self, on_report=None):
+        """Starts a run of every collector on the metrics loop and returns its future without waiting.
+
+        on_report(text) is called from an executor thread once the run is done. Returns
+        None if the previous run is still going.
+        """
+        with self.lock:
+            if self.running is not None and not self.running.done():
+                log_event(logger, logging.WARNING, "metrics_run_skipped", reason="previous run still going")
+                return None
+            self.running = asyncio.run_coroutine_threadsafe(self.collect_all(on_report), self.loop)
+            self.running.add_done_callback(self.log_failure)
+            return self.running
+
+    @staticmethod
+    def log_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            log_event(logger, logging.ERROR, "metrics_run_failed", error=str(future.exception()))
+
+    def report(self, names=None):
+        """Latest result of every collector (or of those in names), in report order, as one message.
+
+        Results the latest run didn't refresh are marked stale, with the time they were collected.
+        """
+        parts = []
+        for name, _ in self.collectors:
+            if name not in self.latest or (names is not None and name not in names):
+                continue
+            entry = self.latest[name]
+            if name in self.fresh:
+                parts.append(entry["text"])
+            else:
+                parts.append(f"{entry['text']}\n(stale, collected {entry['collected_at']})")
+        return "\n\n".join(parts)
+
+    def collected_at(self):
+        """Time of the oldest result in the report, or None if nothing was collected yet."""
+        times = [self.latest[name]["collected_at"] for name, _ in self.collectors if name in self.latest]
+        return min(times) if times else None
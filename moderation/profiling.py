@@ -0,0 +1,150 @@
+"""On-demand profiling and memory snapshots.
+
+SamplingProfiler periodically samples the stack of every thread (the dispatcher,
+its workers and the job queue) with sys._current_frames. Its overhead depends on
+the sampling interval, not on how much Python the bot runs, so it is safe to use
+in production during a raid. Samples of threads that are blocked rather than
+running (waiting on a queue or lock, in select, reading a socket) are counted
+but left out, so percentages are shares of the time the bot actually spent
+running code. Results come back as a top-N summary plus a raw stats file of
+collapsed stacks (one "thread;outer;...;inner count" line per stack, the format
+flamegraph.pl and speedscope read).
+
+deep_sizeof gives a rough recursive size of the bot's long-lived structures for
+periodic memory snapshots.
+"""
+import os
+import sys
+import threading
+from time import sleep, perf_counter
+from collections import Counter
+from datetime import datetime, timezone
+
+DEFAULT_INTERVAL = 0.005
+PROFILE_FOLDER = "data"
+MAX_STACK_DEPTH = 64
+
+# (file, function) of a leaf frame whose thread is blocked, not running: lock and queue
+# waits, selector polls, socket reads, and Updater.idle()'s sleep loop on the main thread
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("socket.py", "readinto"),
+    ("ssl.py", "read"),
+    ("ssl.py", "recv_into"),
+    ("connection.py", "_recv"),
+    ("updater.py", "idle"),
+}
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def is_idle(frame):
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+
+class SamplingProfiler:
+
+    def __init__(self, interval=DEFAULT_INTERVAL, include_idle=False):
+        self.interval = interval
+        self.include_idle = include_idle
+        self.samples = 0
+        self.idle_samples = 0
+        self.self_counts = Counter()    # function -> samples where it was running
+        self.total_counts = Counter()   # function -> samples where it was on the stack
+        self.stacks = Counter()         # collapsed stack -> samples
+
+    def sample(self, skip_thread_ids=()):
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id in skip_thread_ids:
+                continue
+            if not self.include_idle and is_idle(frame):
+                self.idle_samples += 1
+                continue
+            labels = []
+            while frame is not None and len(labels) < MAX_STACK_DEPTH:
+                labels.append(frame_label(frame))
+                frame = frame.f_back
+            if not labels:
+                continue
+            self.samples += 1
+            self.self_counts[labels[0]] += 1
+            for label in set(labels):
+                self.total_counts[label] += 1
+            thread_name = thread_names.get(thread_id, str(thread_id))
+            self.stacks[";".join([thread_name] + labels[::-1])] += 1
+
+    def run(self, seconds):
+        """Samples every thread except the calling one for `seconds`."""
+        own_thread = {threading.get_ident()}
+        deadline = perf_counter() + seconds
+        while perf_counter() < deadline:
+            self.sample(own_thread)
+            sleep(self.interval)
+
+    def summary(self, top_n=20):
+        if not self.samples:
+            return f"No busy samples collected ({self.idle_samples} idle)."
+        lines = [f"{self.samples} busy samples ({self.idle_samples} idle left out), top {top_n} by own time:", "  self%  total%  function"]
+        for label, count in self.self_counts.most_common(top_n):
+            lines.append(f"{count / self.samples:7.1%} {self.total_counts[label] / self.samples:7.1%}  {label}")
+        return "\n".join(lines)
+
+    def save(self, folder=PROFILE_FOLDER):
+        """Writes the collapsed stacks to folder/profile_<utc time>.folded and returns the path."""
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"profile_{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+_profile_lock = threading.Lock()
+
+def profile_in_background(seconds, on_done, top_n=20, interval=DEFAULT_INTERVAL):
+    """Profiles for `seconds` on a background thread, then calls on_done(summary, path).
+
+    Returns False without starting if a profile is already running.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return False
+
+    def run():
+        try:
+            profiler = SamplingProfiler(interval)
+            profiler.run(seconds)
+            path = profiler.save()
+            on_done(profiler.summary(top_n), path)
+        finally:
+            _profile_lock.release()
+
+    threading.Thread(target=run, name="profiler", daemon=True).start()
+    return True
+
+def deep_sizeof(obj, seen=None):
+    """Approximate bytes held by obj and everything it references through containers and instance dicts."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj, 0)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)) or type(obj).__name__ == "deque":
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__") and not isinstance(obj, type):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+def process_rss_bytes():
+    """Current resident set size, or None where /proc isn't available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
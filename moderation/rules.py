@@ -0,0 +1,282 @@
+"""Declarative moderation rule pipeline.
+
+Each moderation check is a Rule: a check function plus the settings declared for
+it in filters/rules.json (action, priority, cost, short-circuit). RuleEngine runs
+the rules in priority order and returns the first short-circuiting hit as a
+Decision. Applying the decision (deleting, banning, muting) is left to the caller,
+so the same pipeline can run in dry-run mode.
+
+Rules that share a priority must share an action, so running them in any order
+gives the same outcome. Within a priority, rules run cheapest first by declared
+cost. In adaptive mode they are reordered by measured time per hit instead.
+
+Exempt rules (short_circuit false) don't end evaluation. When they hit, they
+switch off the rules named in their "exempts" list for the rest of the message.
+An exempt rule can't share its priority with a rule it exempts or with any
+short-circuiting rule, so it always runs before them.
+
+Stateful rules (the spam window) depend on the messages seen before. All other
+checks are pure, so they can be run ahead of time (check_all) in another process
+and handed to evaluate() as known results.
+"""
+import re
+from time import perf_counter
+
+# Actions
+DELETE = "delete"
+BAN = "ban"
+MUTE = "mute"
+MUTE_SPAMMERS = "mute_spammers"
+EXEMPT = "exempt"
+
+ACTIONS = {DELETE, BAN, MUTE, MUTE_SPAMMERS, EXEMPT}
+
+# Suspicious names to auto-ban
+SUSPICIOUS_USERNAMES = [
+    "dev", "developer", "admin", "mod", "owner", "arc", "arc_agent", "arc agent", "arch_agent", "arch agent", "support", "helpdesk", "administrator", "arc admin", "arc_admin"
+]
+
+# Adaptive mode re-sorts each priority group every this many evaluations
+ADAPTIVE_REORDER_INTERVAL = 1000
+
+def contains_multiplication_phrase(text):
+    text = text.lower()
+    # Match digit(s) possibly separated by spaces, next to an 'x'
+    pattern = r"(?:\d\s*)+x|x\s*(?:\d\s*)+"
+    return re.search(pattern, text)
+
+def contains_give_sol_phrase(text):
+    text = text.lower()
+    # Match 'give' followed by a number and then 'sol' or 'solana'
+    pattern = r"give\s*(\d+)\s*(sol|solana)"
+    return re.search(pattern, text)
+
+def contains_non_x_links(text: str) -> bool:
+    # Matches all URLs
+    url_pattern = r'(https?://[^\s]+)'
+    urls = re.findall(url_pattern, text)
+
+    for url in urls:
+        # Allow only Twitter/X links
+        if not re.search(r'https?://(www\.)?(x\.com|twitter\.com)/[^\s]+', url):
+            return True  # Found a non-X link
+    return False
+
+class MessageFacts:
+    """What the rules get to see about a message.
+
+    text is the lowercased message text, raw_text the original. exempt collects
+    the rule names switched off by exempt rules while evaluating.
+    """
+
+    def __init__(self, text, raw_text, user_id, full_name, username, is_forward, now=None):
+        self.text = text
+        self.raw_text = raw_text
+        self.user_id = user_id
+        self.full_name = full_name
+        self.username = username
+        self.is_forward = is_forward
+        self.now = now
+        self.exempt = set()
+
+def build_checks(config, suspicious_usernames, spam_check):
+    """Check functions by rule name. A check returns None for no hit, anything else is the hit's detail.
+
+    spam_check(facts) returns the user ids to mute for a copy-paste wave (possibly empty).
+    """
+    def too_short(facts):
+        return True if len(facts.text.strip()) < 2 else None
+
+    def suspicious_name(facts):
+        name_username = f"{facts.full_name} {facts.username or ''}".lower()
+        return next((keyword for keyword in suspicious_usernames if keyword in name_username), None)
+
+    def non_x_links(facts):
+        return True if contains_non_x_links(facts.raw_text) else None
+
+    def multiplier(facts):
+        match = contains_multiplication_phrase(facts.text)
+        return match.group(0) if match else None
+
+    def give_sol(facts):
+        match = contains_give_sol_phrase(facts.text)
+        return match.group(0) if match else None
+
+    def forwarded(facts):
+        return True if facts.is_forward else None
+
+    def filter_trigger(facts):
+        return config.match_trigger(facts.text)
+
+    def whitelist(facts):
+        return True if facts.text.strip() in config.whitelist else None
+
+    def spam(facts):
+        return spam_check(facts) or None
+
+    def ban_phrase(facts):
+        return config.match_phrase("ban", facts.text)
+
+    def mute_phrase(facts):
+        return config.match_phrase("mute", facts.text)
+
+    def delete_phrase(facts):
+        return config.match_phrase("delete", facts.text)
+
+    return {
+        "too_short": too_short,
+        "suspicious_name": suspicious_name,
+        "non_x_links": non_x_links,
+        "multiplier": multiplier,
+        "give_sol": give_sol,
+        "forwarded": forwarded,
+        "filter_trigger": filter_trigger,
+        "whitelist": whitelist,
+        "spam": spam,
+        "ban_phrase": ban_phrase,
+        "mute_phrase": mute_phrase,
+        "delete_phrase": delete_phrase,
+    }
+
+class Rule:
+
+    def __init__(self, name, check, action, priority=0, cost=1, short_circuit=True, exempts=(), reply=None, stateful=False):
+        if action not in ACTIONS:
+            raise ValueError(f"Rule '{name}' has unknown action '{action}'")
+        self.name = name
+        self.check = check
+        self.action = action
+        self.priority = priority
+        self.cost = cost
+        self.short_circuit = short_circuit
+        self.exempts = tuple(exempts)
+        self.reply = reply
+        self.stateful = stateful
+
+        # stats
+        self.evaluations = 0
+        self.hits = 0
+        self.seconds = 0.0
+
+    def hit_rate(self):
+        return self.hits / self.evaluations if self.evaluations else 0.0
+
+    def avg_seconds(self):
+        return self.seconds / self.evaluations if self.evaluations else 0.0
+
+class Decision:
+    """The short-circuiting rule that decided a message, and its check's detail."""
+
+    def __init__(self, rule, detail):
+        self.rule = rule
+        self.detail = detail
+
+    @property
+    def action(self):
+        return self.rule.action
+
+class RuleEngine:
+
+    def __init__(self, rules, adaptive=False):
+        self.rules = list(rules)
+        self.adaptive = adaptive
+        self.evaluations = 0
+        self._validate()
+        self.order = self._static_order()
+
+    def _validate(self):
+        names = [rule.name for rule in self.rules]
+        if len(names) != len(set(names)):
+            raise ValueError("Rule names must be unique")
+        actions_by_priority = {}
+        for rule in self.rules:
+            if rule.short_circuit:
+                action = actions_by_priority.setdefault(rule.priority, rule.action)
+                if action != rule.action:
+                    raise ValueError(f"Rules with priority {rule.priority} mix actions '{action}' and '{rule.action}'")
+        # within a priority the order follows cost or timings, so an exempt rule needs a priority of its own
+        for rule in self.rules:
+            for other in self.rules:
+                if other is not rule and rule.exempts and other.priority == rule.priority and (other.name in rule.exempts or other.short_circuit):
+                    raise ValueError(f"Exempt rule '{rule.name}' shares priority {rule.priority} with '{other.name}'")
+
+    def _static_order(self):
+        # stable sort: config order breaks cost ties
+        return sorted(self.rules, key=lambda rule: (rule.priority, rule.cost))
+
+    def _adaptive_order(self):
+        def expected_cost(rule):
+            # time spent per hit; unmeasured rules go first, rules that never hit go last
+            if not rule.evaluations:
+                return 0.0
+            return rule.avg_seconds() / rule.hit_rate() if rule.hits else float("inf")
+        return sorted(self.rules, key=lambda rule: (rule.priority, expected_cost(rule)))
+
+    def check_all(self, facts):
+        """Runs every stateless check, ignoring order and short-circuits. Returns {rule name: detail or None}."""
+        return {rule.name: rule.check(facts) for rule in self.rules if not rule.stateful}
+
+    def evaluate(self, facts, known=None):
+        """Runs the rules in order. Returns the Decision of the first short-circuiting hit, or None.
+
+        known maps rule names to results already computed by check_all; those checks aren't run again.
+        """
+        self.evaluations += 1
+        if self.adaptive and self.evaluations % ADAPTIVE_REORDER_INTERVAL == 0:
+            self.order = self._adaptive_order()
+
+        for rule in self.order:
+            if rule.name in facts.exempt:
+                continue
+            # exempt rules with nothing left to switch off
+            if rule.exempts and facts.exempt.issuperset(rule.exempts):
+                continue
+
+            started = perf_counter()
+            detail = known[rule.name] if known is not None and rule.name in known else rule.check(facts)
+            rule.seconds += perf_counter() - started
+            rule.evaluations += 1
+            if detail is None:
+                continue
+
+            rule.hits += 1
+            facts.exempt.update(rule.exempts)
+            if rule.short_circuit:
+                return Decision(rule, detail)
+        return None
+
+    def stats(self):
+        """Per-rule hit rates and timings, in the current evaluation order."""
+        return [
+            {
+                "rule": rule.name,
+                "priority": rule.priority,
+                "evaluations": rule.evaluations,
+                "hits": rule.hits,
+                "hit_rate": rule.hit_rate(),
+                "avg_us": rule.avg_seconds() * 1e6,
+            }
+            for rule in self.order
+        ]
+
+def build_engine(rule_configs, checks, adaptive=False):
+    """Builds the engine from rule settings (as in rules.json) and check functions by name."""
+    rules = []
+    for rule_config in rule_configs:
+        if not rule_config.get("enabled", True):
+            continue
+        name = rule_config["name"]
+        if name not in checks:
+            raise ValueError(f"No check registered for rule '{name}'")
+        rules.append(Rule(
+            name=name,
+            check=checks[name],
+            action=rule_config["action"],
+            priority=rule_config.get("priority", 0),
+            cost=rule_config.get("cost", 1),
+            short_circuit=rule_config.get("short_circuit", True),
+            exempts=rule_config.get("exempts", ()),
+            reply=rule_config.get("reply"),
+            stateful=rule_config.get("stateful", False),
+        ))
+    return RuleEngine(rules, adaptive=adaptive)
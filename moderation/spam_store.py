@@ -0,0 +1,144 @@
+"""Storage for the copy-paste spam window.
+
+MemorySpamStore keeps state in process, as the bot always has. SQLiteSpamStore
+keeps it in a local SQLite database (WAL mode) so several worker processes on
+one machine see the same window and a spam wave is counted globally.
+
+Both stores keep the same semantics:
+- record() appends (user_id, now) for a message text and returns every entry for
+  that text within `window`. When there are `threshold` or more, the text is
+  flagged as spam.
+- is_recent_spam() is true for texts flagged within `record_duration`.
+- cleanup() drops expired flags (returning their texts) and stale window entries.
+"""
+import os
+import sqlite3
+import threading
+from collections import defaultdict
+from datetime import datetime, timezone
+
+DEFAULT_SQLITE_PATH = "data/spam_state.sqlite3"
+
+class MemorySpamStore:
+
+    def __init__(self, threshold, window, record_duration):
+        self.threshold = threshold
+        self.window = window
+        self.record_duration = record_duration
+        self.tracker = defaultdict(list)  # message text -> [(user_id, timestamp)] within window
+        self.records = {}                 # flagged message text -> timestamp flagged
+
+    def record(self, message_text, user_id, now):
+        entries = self.tracker[message_text]
+        entries.append((user_id, now))
+        recent = [entry for entry in entries if now - entry[1] <= self.window]
+        self.tracker[message_text] = recent
+        if len(recent) >= self.threshold:
+            self.records[message_text] = now
+        return recent
+
+    def is_recent_spam(self, message_text, now):
+        timestamp = self.records.get(message_text)
+        return bool(timestamp and now - timestamp <= self.record_duration)
+
+    def cleanup(self, now):
+        expired = [text for text, timestamp in self.records.items() if now - timestamp > self.record_duration]
+        for text in expired:
+            del self.records[text]
+        for text, entries in list(self.tracker.items()):
+            if not entries or now - entries[-1][1] > self.window:
+                del self.tracker[text]
+        return expired
+
+    def sizes(self):
+        return {
+            "tracked_texts": len(self.tracker),
+            "tracked_entries": sum(len(entries) for entries in self.tracker.values()),
+            "flagged_texts": len(self.records),
+        }
+
+class SQLiteSpamStore:
+
+    def __init__(self, threshold, window, record_duration, path=DEFAULT_SQLITE_PATH):
+        self.threshold = threshold
+        self.window = window
+        self.record_duration = record_duration
+        self.path = path
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # autocommit mode, transactions are opened explicitly with BEGIN IMMEDIATE
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS spam_messages (
+                message_text TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                ts REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS spam_messages_text_ts ON spam_messages (message_text, ts);
+            CREATE TABLE IF NOT EXISTS spam_records (
+                message_text TEXT PRIMARY KEY,
+                ts REAL NOT NULL
+            );
+        """)
+        self.lock = threading.Lock()
+
+    def _transaction(self, work):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work(self.conn)
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+            return result
+
+    def record(self, message_text, user_id, now):
+        ts = now.timestamp()
+        window_start = ts - self.window.total_seconds()
+
+        def work(conn):
+            conn.execute("INSERT INTO spam_messages (message_text, user_id, ts) VALUES (?, ?, ?)", (message_text, user_id, ts))
+            conn.execute("DELETE FROM spam_messages WHERE message_text = ? AND ts < ?", (message_text, window_start))
+            rows = conn.execute(
+                "SELECT user_id, ts FROM spam_messages WHERE message_text = ? ORDER BY ts", (message_text,)
+            ).fetchall()
+            if len(rows) >= self.threshold:
+                conn.execute("INSERT OR REPLACE INTO spam_records (message_text, ts) VALUES (?, ?)", (message_text, ts))
+            return rows
+
+        rows = self._transaction(work)
+        return [(user_id, datetime.fromtimestamp(row_ts, timezone.utc)) for user_id, row_ts in rows]
+
+    def is_recent_spam(self, message_text, now):
+        with self.lock:
+            row = self.conn.execute("SELECT ts FROM spam_records WHERE message_text = ?", (message_text,)).fetchone()
+        return bool(row and now.timestamp() - row[0] <= self.record_duration.total_seconds())
+
+    def cleanup(self, now):
+        ts = now.timestamp()
+
+        def work(conn):
+            cutoff = ts - self.record_duration.total_seconds()
+            expired = [row[0] for row in conn.execute("SELECT message_text FROM spam_records WHERE ts < ?", (cutoff,))]
+            conn.execute("DELETE FROM spam_records WHERE ts < ?", (cutoff,))
+            conn.execute("DELETE FROM spam_messages WHERE ts < ?", (ts - self.window.total_seconds(),))
+            return expired
+
+        return self._transaction(work)
+
+    def sizes(self):
+        with self.lock:
+            return {
+                "tracked_texts": self.conn.execute("SELECT COUNT(DISTINCT message_text) FROM spam_messages").fetchone()[0],
+                "tracked_entries": self.conn.execute("SELECT COUNT(*) FROM spam_messages").fetchone()[0],
+                "flagged_texts": self.conn.execute("SELECT COUNT(*) FROM spam_records").fetchone()[0],
+            }
+
+def create_spam_store(threshold, window, record_duration, sqlite_path=None):
+    """SQLite-backed store when a path is given, in-memory store otherwise."""
+    if sqlite_path:
+        return SQLiteSpamStore(threshold, window, record_duration, sqlite_path)
+    return MemorySpamStore(threshold, window, record_duration)
@@ -0,0 +1,164 @@
+"""Outbound filter-response throttling.
+
+Every filter response costs a Bot API call, so repeats are rate limited by two
+token buckets: one per (chat, trigger) and one per chat across all triggers. A
+response is sent only when both buckets have a token.
+
+Per-trigger limits can be set on any entry in filters.json:
+
+    "/we_arc": {
+        ...,
+        "throttle": {"cooldown": 60, "burst": 1, "reply_to_latest": true}
+    }
+
+cooldown is the seconds needed to regain one token, burst the bucket size, and
+a cooldown of 0 turns throttling off for that trigger: its responses are always
+sent and don't use up the chat's tokens either. With reply_to_latest,
+repeats inside the window are coalesced into a single reply to the latest asker,
+sent as soon as the buckets refill. Without it they are dropped.
+"""
+import threading
+from time import monotonic
+from collections import Counter
+
+# Defaults for filters.json entries without a "throttle" block
+DEFAULT_TRIGGER_COOLDOWN = 30
+DEFAULT_TRIGGER_BURST = 1
+DEFAULT_REPLY_TO_LATEST = False
+
+# Limit on filter responses per chat, across all triggers
+DEFAULT_CHAT_COOLDOWN = 6
+DEFAULT_CHAT_BURST = 5
+
+class TokenBucket:
+    """Holds up to `burst` tokens and regains one every `cooldown` seconds."""
+
+    def __init__(self, cooldown, burst, now):
+        self.cooldown = cooldown
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def refill(self, now):
+        if self.cooldown > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) / self.cooldown)
+        else:
+            self.tokens = float(self.burst)
+        self.updated = now
+
+    def has_token(self, now):
+        self.refill(now)
+        return self.tokens >= 1
+
+    def take(self, now):
+        self.refill(now)
+        self.tokens -= 1
+
+    def wait_time(self, now):
+        """Seconds until the bucket holds a whole token again."""
+        self.refill(now)
+        return max(0.0, (1 - self.tokens) * self.cooldown)
+
+    def is_full(self, now):
+        self.refill(now)
+        return self.tokens >= self.burst
+
+class ResponseThrottle:
+    """Decides whether a filter response may be sent now, and tracks coalesced repeats."""
+
+    SEND = "send"
+    SCHEDULE = "schedule"    # suppressed, caller should schedule a flush after the returned delay
+    SUPPRESS = "suppress"    # suppressed, nothing else to do
+
+    def __init__(self, filters, chat_cooldown=DEFAULT_CHAT_COOLDOWN, chat_burst=DEFAULT_CHAT_BURST):
+        self.filters = filters
+        self.chat_cooldown = chat_cooldown
+        self.chat_burst = chat_burst
+
+        self.trigger_buckets = {}   # (chat_id, trigger) -> TokenBucket
+        self.chat_buckets = {}      # chat_id -> TokenBucket
+        self.pending = {}           # (chat_id, trigger) -> latest suppressed message awaiting a flush
+
+        self.suppressed = Counter()  # trigger -> suppressed responses
+        self.coalesced = Counter()   # trigger -> flushed replies standing in for suppressed ones
+
+        self.lock = threading.Lock()
+
+    def settings(self, trigger):
+        """Returns (cooldown, burst, reply_to_latest) for a trigger."""
+        throttle = self.filters.get(trigger, {}).get("throttle") or {}
+        return (
+            throttle.get("cooldown", DEFAULT_TRIGGER_COOLDOWN),
+            throttle.get("burst", DEFAULT_TRIGGER_BURST),
+            throttle.get("reply_to_latest", DEFAULT_REPLY_TO_LATEST),
+        )
+
+    def _buckets(self, chat_id, trigger, now):
+        key = (chat_id, trigger)
+        trigger_bucket = self.trigger_buckets.get(key)
+        if trigger_bucket is None:
+            cooldown, burst, _ = self.settings(trigger)
+            trigger_bucket = self.trigger_buckets[key] = TokenBucket(cooldown, burst, now)
+        chat_bucket = self.chat_buckets.get(chat_id)
+        if chat_bucket is None:
+            chat_bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_cooldown, self.chat_burst, now)
+        return trigger_bucket, chat_bucket
+
+    def _try_take(self, chat_id, trigger, now):
+        trigger_bucket, chat_bucket = self._buckets(chat_id, trigger, now)
+        if trigger_bucket.cooldown <= 0:
+            return None
+        if trigger_bucket.has_token(now) and chat_bucket.has_token(now):
+            trigger_bucket.take(now)
+            chat_bucket.take(now)
+            return None
+        return max(trigger_bucket.wait_time(now), chat_bucket.wait_time(now))
+
+    def request(self, chat_id, trigger, message, now=None):
+        """Registers a response request. Returns (decision, delay).
+
+        delay is only meaningful for SCHEDULE: seconds until flush() should be called.
+        """
+        now = monotonic() if now is None else now
+        with self.lock:
+            delay = self._try_take(chat_id, trigger, now)
+            if delay is None:
+                return self.SEND, 0
+
+            self.suppressed[trigger] += 1
+            _, _, reply_to_latest = self.settings(trigger)
+            if not reply_to_latest:
+                return self.SUPPRESS, 0
+
+            key = (chat_id, trigger)
+            already_scheduled = key in self.pending
+            self.pending[key] = message
+            return (self.SUPPRESS, 0) if already_scheduled else (self.SCHEDULE, delay)
+
+    def flush(self, chat_id, trigger, now=None):
+        """Called when a scheduled flush is due. Returns (message, delay).
+
+        message is the latest asker to reply to, or None. If the buckets are still
+        empty, message is None and delay is when to try again.
+        """
+        now = monotonic() if now is None else now
+        with self.lock:
+            key = (chat_id, trigger)
+            if key not in self.pending:
+                return None, 0
+            delay = self._try_take(chat_id, trigger, now)
+            if delay is not None:
+                return None, delay
+            self.coalesced[trigger] += 1
+            return self.pending.pop(key), 0
+
+    def prune(self, now=None):
+        """Drops full, idle buckets so the bucket maps don't grow without bound."""
+        now = monotonic() if now is None else now
+        with self.lock:
+            for key, bucket in list(self.trigger_buckets.items()):
+                if key not in self.pending and bucket.is_full(now):
+                    del self.trigger_buckets[key]
+            for chat_id, bucket in list(self.chat_buckets.items()):
+                if bucket.is_full(now):
+                    del self.chat_buckets[chat_id]
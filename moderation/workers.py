@@ -0,0 +1,171 @@
+"""Multi-process moderation.
+
+One ingest process polls Telegram and partitions updates by chat_id across N
+worker processes. Each chat always maps to the same worker, and every worker
+handles its queue in order, so updates within a chat keep their order. State
+that must be global (the spam window) lives in a shared SQLite store, see
+moderation/spam_store.py.
+
+The ingest process never blocks on a worker for long: a worker that died is
+restarted on its queue, and updates for a worker that is down or too far behind
+are dropped and logged.
+"""
+import json
+import queue
+import logging
+import importlib
+import multiprocessing
+from time import monotonic
+
+from moderation.log import get_logger, log_event
+
+logger = get_logger(__name__)
+
+# Seconds submit() waits on a full worker queue before dropping the update
+PUT_TIMEOUT = 1.0
+
+# Seconds each worker gets to finish setup on start()
+READY_TIMEOUT = 60
+
+# A dead worker is restarted at most this often; updates for it are dropped in between
+RESTART_INTERVAL = 30
+
+def partition(chat_id, num_workers):
+    """Index of the worker that owns chat_id. Stable for a given number of workers."""
+    return chat_id % num_workers
+
+class PartitionedPool:
+    """N worker processes, each fed by its own queue.
+
+    target is called in the worker as target(index, queue, status, *args). It should
+    put (index, None) on status once it is set up, or (index, error) if setup failed,
+    then consume payloads until it reads the None sentinel.
+    """
+
+    def __init__(self, num_workers, target, args=(), queue_size=10000):
+        # spawn, not fork: the ingest process runs polling and job threads
+        self.context = multiprocessing.get_context("spawn")
+        self.target = target
+        self.args = tuple(args)
+        self.queue_size = queue_size
+        self.queues = [self.context.Queue(maxsize=queue_size) for _ in range(num_workers)]
+        self.status = self.context.Queue()
+        self.processes = [self.process(index) for index in range(num_workers)]
+        self.restarted_at = [0.0] * num_workers
+        self.dropped = 0
+
+    def process(self, index):
+        return self.context.Process(
+            target=self.target,
+            args=(index, self.queues[index], self.status) + self.args,
+            name=f"moderation-worker-{index}",
+            daemon=True,
+        )
+
+    def start(self, timeout=READY_TIMEOUT):
+        """Starts every worker and waits for each to report its setup. Raises RuntimeError if one fails."""
+        for process in self.processes:
+            process.start()
+
+        waiting = set(range(len(self.processes)))
+        deadline = monotonic() + timeout
+        while waiting:
+            try:
+                index, error = self.status.get(timeout=max(0.0, deadline - monotonic()))
+            except queue.Empty:
+                error = f"workers {sorted(waiting)} not ready after {timeout}s"
+                index = None
+            if error is None:
+                waiting.discard(index)
+                continue
+            self.stop(timeout=1)
+            raise RuntimeError(f"moderation worker failed to start: {error}")
+
+    def restart(self, index):
+        """Replaces a dead worker. Returns False while the last restart is too recent."""
+        process = self.processes[index]
+        if monotonic() - self.restarted_at[index] < RESTART_INTERVAL:
+            return False
+        # a worker killed inside queue.get() leaves the queue locked, so the new one gets a new queue
+        # and whatever the old one hadn't read is lost
+        log_event(logger, logging.ERROR, "worker_died", worker=process.name, exitcode=process.exitcode,
+                  lost=self.queues[index].qsize())
+        self.restarted_at[index] = monotonic()
+        self.queues[index] = self.context.Queue(maxsize=self.queue_size)
+        self.processes[index] = self.process(index)
+        self.processes[index].start()
+        return True
+
+    def submit(self, chat_id, payload):
+        """Queues payload for the worker that owns chat_id. Returns False if the update was dropped."""
+        index = partition(chat_id, len(self.queues))
+        if not self.processes[index].is_alive() and not self.restart(index):
+            return self.drop(index, "worker dead")
+        try:
+            self.queues[index].put(payload, timeout=PUT_TIMEOUT)
+        except queue.Full:
+            return self.drop(index, "queue full")
+        return True
+
+    def drop(self, index, reason):
+        self.dropped += 1
+        log_event(logger, logging.WARNING, "worker_update_dropped", worker=index, reason=reason, dropped=self.dropped)
+        return False
+
+    def stop(self, timeout=10):
+        """Lets every worker drain its queue, then waits for it to exit."""
+        for index, process in enumerate(self.processes):
+            try:
+                self.queues[index].put(None, timeout=timeout if process.is_alive() else 0)
+            except queue.Full:
+                pass
+        for process in self.processes:
+            if process.pid is None:
+                continue
+            process.join(timeout)
+            if process.is_alive():
+                log_event(logger, logging.WARNING, "worker_terminated", worker=process.name, timeout=timeout)
+                process.terminate()
+
+def telegram_worker(index, queue, status, token, setup_path):
+    """Worker process: rebuilds each update from JSON and runs it through a local dispatcher.
+
+    setup_path ("module:function") names the function that registers the handlers
+    on the worker's dispatcher. A setup error is reported on status and ends the worker.
+    """
+    from queue import Queue
+    from telegram import Bot, Update
+    from telegram.ext import Dispatcher, JobQueue
+
+    try:
+        module_name, function_name = setup_path.split(":")
+        setup = getattr(importlib.import_module(module_name), function_name)
+
+        bot = Bot(token)
+        job_queue = JobQueue()
+        dispatcher = Dispatcher(bot, Queue(), workers=0, job_queue=job_queue)
+        job_queue.set_dispatcher(dispatcher)
+        setup(dispatcher)
+        job_queue.start()
+    except Exception as e:
+        log_event(logger, logging.ERROR, "worker_setup_failed", worker=index, error=repr(e))
+        status.put((index, repr(e)))
+        raise
+    status.put((index, None))
+    log_event(logger, logging.INFO, "worker_ready", worker=index)
+
+    for payload in iter(queue.get, None):
+        try:
+            update = Update.de_json(json.loads(payload), bot)
+        except Exception as e:
+            log_event(logger, logging.ERROR, "worker_decode_failed", worker=index, error=str(e))
+            continue
+        dispatcher.process_update(update)
+
+    job_queue.stop()
+    log_event(logger, logging.INFO, "worker_stopped", worker=index)
+
+def start_telegram_workers(num_workers, token, setup_path):
+    pool = PartitionedPool(num_workers, telegram_worker, args=(token, setup_path))
+    pool.start()
+    return pool
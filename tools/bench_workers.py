@@ -0,0 +1,162 @@
+"""Throughput benchmark for multi-process moderation.
+
+Runs the production path with 1..N workers: PartitionedPool starts
+telegram_worker processes that run setup_moderation, and every synthetic update
+is submitted on its own as JSON, the way forward_update hands updates over. The
+handlers use real timestamps and, by default, the shared SQLite spam window that
+bot.py uses with workers. Only the Bot's HTTP requests are stubbed out, so
+Telegram round trips (one getChatAdministrators per message in check_message)
+are not part of the numbers. Each worker also checks that the messages of each
+chat arrive in order.
+
+    python -m tools.bench_workers --messages 50000 --chats 200 --max-workers 4
+    python -m tools.bench_workers --spam-store memory   # one spam window per worker
+
+Run it from the repository root, with python-telegram-bot installed. Workers log
+as they do under bot.py; redirect stdout, or set LOG_LEVEL=WARNING to leave
+logging out of the numbers. Speedup is bounded by the number of cores.
+"""
+import os
+import json
+import random
+import argparse
+import tempfile
+from time import perf_counter, time
+
+from moderation.workers import PartitionedPool, telegram_worker
+
+SETUP_PATH = "tools.bench_workers:setup_bench"
+BENCH_TOKEN = "123456:bench"
+BENCH_CHAT_PREFIX = -1000000000000
+ADMIN_ID = 1
+END_UPDATE_ID = -1
+
+SAMPLE_TEXTS = [
+    "gm complex", "when is the next update", "/we_arc", "airdropp is live dm me",
+    "check https://x.com/arcdotfun/status/1", "check https://example.com", "100x soon",
+    "give 5 sol", "the rig trading kit is great", "scam", "wen binance",
+]
+
+# copy-paste waves, the share of traffic the spam window catches
+WAVE_TEXTS = ["claim your reward now", "airdrop is live", "free tokens here"]
+WAVE_SHARE = 0.05
+
+def stub_post(self, endpoint, data=None, timeout=None, api_kwargs=None):
+    """Stands in for Bot._post: answers the calls the handlers read, acknowledges the rest."""
+    if endpoint == "getMe":
+        return {"id": 42, "is_bot": True, "first_name": "bench", "username": "benchbot"}
+    if endpoint == "getChatAdministrators":
+        return [{"status": "administrator", "user": {"id": ADMIN_ID, "is_bot": False, "first_name": "admin"}}]
+    return True
+
+# runs in each worker in place of setup_moderation: same handlers, stubbed HTTP, plus an order check
+def setup_bench(dispatcher):
+    from telegram import Bot, Update
+    from telegram.ext import TypeHandler
+    from moderation.log import setup_logging
+    from moderation.handlers import setup_moderation
+
+    # workers spawned by bot.py set up logging when they import it
+    setup_logging()
+    Bot._post = stub_post
+    last_seen = {}
+    counts = {"handled": 0, "out_of_order": 0}
+
+    def track(update, context):
+        if update.update_id == END_UPDATE_ID:
+            with open(os.path.join(os.environ["BENCH_RESULTS_DIR"], f"{os.getpid()}.json"), "w") as f:
+                json.dump(counts, f)
+            return
+        message = update.message
+        if message.message_id <= last_seen.get(message.chat_id, -1):
+            counts["out_of_order"] += 1
+        last_seen[message.chat_id] = message.message_id
+        counts["handled"] += 1
+
+    # before check_message, which stops the update when it acts on a message
+    dispatcher.add_handler(TypeHandler(Update, track), group=-1)
+    setup_moderation(dispatcher)
+
+def generate_updates(count, chats, seed=0):
+    """(chat_id, update JSON) pairs, message ids counting up within each chat."""
+    rng = random.Random(seed)
+    chat_ids = [BENCH_CHAT_PREFIX - i for i in range(chats)]
+    sequences = dict.fromkeys(chat_ids, 0)
+    updates = []
+    for update_id in range(count):
+        chat_id = rng.choice(chat_ids)
+        if rng.random() < WAVE_SHARE:
+            text = rng.choice(WAVE_TEXTS)
+        else:
+            text = f"{rng.choice(SAMPLE_TEXTS)} {rng.randint(0, 10000)}"
+        user_id = rng.randint(2, 500)
+        message = {
+            "message_id": sequences[chat_id],
+            "date": int(time()),
+            "chat": {"id": chat_id, "type": "supergroup", "title": "bench"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        updates.append((chat_id, json.dumps({"update_id": update_id, "message": message})))
+        sequences[chat_id] += 1
+    return updates
+
+def run(num_workers, updates, results_dir):
+    pool = PartitionedPool(num_workers, telegram_worker, args=(BENCH_TOKEN, SETUP_PATH))
+    pool.start()
+
+    started = perf_counter()
+    dropped = 0
+    for chat_id, payload in updates:
+        if not pool.submit(chat_id, payload):
+            dropped += 1
+    for index in range(num_workers):
+        pool.submit(index, json.dumps({"update_id": END_UPDATE_ID}))
+    # stop() returns once every worker has drained its queue
+    pool.stop(timeout=600)
+    elapsed = perf_counter() - started
+
+    handled = out_of_order = 0
+    for name in os.listdir(results_dir):
+        with open(os.path.join(results_dir, name)) as f:
+            counts = json.load(f)
+        handled += counts["handled"]
+        out_of_order += counts["out_of_order"]
+    return handled, out_of_order, dropped, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--spam-store", choices=["memory", "sqlite"], default="sqlite")
+    args = parser.parse_args()
+
+    updates = generate_updates(args.messages, args.chats)
+    print(f"{len(updates)} updates over {args.chats} chats, {os.cpu_count()} cores, spam store: {args.spam_store}")
+
+    # read by the spawned workers when setup_moderation runs
+    os.environ["GROUP_CHAT_ID"] = str(BENCH_CHAT_PREFIX)
+    os.environ["MEMORY_SNAPSHOT_INTERVAL"] = "0"
+
+    baseline = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for num_workers in range(1, args.max_workers + 1):
+            results_dir = os.path.join(tmp, f"results_{num_workers}")
+            os.makedirs(results_dir)
+            os.environ["BENCH_RESULTS_DIR"] = results_dir
+            if args.spam_store == "sqlite":
+                os.environ["SPAM_STORE_PATH"] = os.path.join(tmp, f"spam_{num_workers}.sqlite3")
+            else:
+                os.environ.pop("SPAM_STORE_PATH", None)
+
+            handled, out_of_order, dropped, elapsed = run(num_workers, updates, results_dir)
+            throughput = handled / elapsed
+            baseline = baseline or throughput
+            print(f"workers={num_workers}  {throughput:,.0f} msg/s  speedup={throughput / baseline:.2f}x  "
+                  f"handled={handled}  out_of_order={out_of_order}  dropped={dropped}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+"""Parity check between the rule pipeline and the original check_message.
+
+LegacyModerator is a frozen copy of the moderation logic check_message ran
+before filters/rules.json existed: the same checks, in the same order, with one
+regex search per phrase and per trigger. Random messages built from the real
+phrase lists, filter triggers, links, names and copy-paste waves are run through
+it and through RuleEngine (static and adaptive order), and their outcomes are
+compared: the action, the users muted for spam, and the filter response.
+Commands answered ahead of check_message (/filters) are compared too: they must
+reach neither moderation nor the filter responses.
+
+Run it after any change to filters/rules.json or moderation/rules.py:
+
+    python -m tools.rules_parity
+    python -m tools.rules_parity --messages 100000 --seed 7
+
+Exits with status 1 if any outcome differs.
+"""
+import re
+import sys
+import random
+import argparse
+from collections import Counter, deque, defaultdict
+from datetime import datetime, timedelta, timezone
+
+from moderation.compiled_config import build_config
+from moderation.rules import (
+    MUTE_SPAMMERS, SUSPICIOUS_USERNAMES, MessageFacts, build_checks, build_engine,
+    contains_give_sol_phrase, contains_multiplication_phrase, contains_non_x_links,
+)
+from moderation.spam_store import MemorySpamStore
+
+# Same spam window settings as moderation/handlers.py
+SPAM_THRESHOLD = 3
+TIME_WINDOW = timedelta(seconds=15)
+SPAM_RECORD_DURATION = timedelta(minutes=5)
+
+# setup_moderation cleans up spam records every 60 seconds
+CLEANUP_INTERVAL = timedelta(seconds=60)
+
+# Commands registered in group 0 ahead of check_message: by the original bot.py,
+# and by setup_moderation in moderation/handlers.py
+LEGACY_COMMANDS = ("filters",)
+PIPELINE_COMMANDS = ("filters",)
+BOT_USERNAME = "arcbot"
+
+ALLOWED = "allow"
+COMMAND = "command"
+SAMPLES = 5
+
+COMMAND_PATTERN = re.compile(r"/(\w+)(?:@(\w+))?(?!\S)")
+
+def handled_command(raw_text, commands):
+    """True if a CommandHandler for one of commands takes the message before check_message sees it."""
+    match = COMMAND_PATTERN.match(raw_text)
+    if not match or (match.group(2) and match.group(2).lower() != BOT_USERNAME):
+        return False
+    return match.group(1).lower() in commands
+
+class LegacyModerator:
+    """The original check_message decision logic, minus the Telegram calls. Don't edit to match the pipeline."""
+
+    def __init__(self, config):
+        self.filters = config.filters
+        self.ban_phrases = config.ban_phrases
+        self.mute_phrases = config.mute_phrases
+        self.delete_phrases = config.delete_phrases
+        self.whitelist_phrases = config.whitelist_phrases
+        self.spam_tracker = defaultdict(lambda: deque(maxlen=SPAM_THRESHOLD))
+        self.spam_records = {}
+
+    def check_for_spam(self, message_text, user_id, now):
+        self.spam_tracker[message_text].append((user_id, now))
+        recent = [entry for entry in self.spam_tracker[message_text] if now - entry[1] <= TIME_WINDOW]
+        self.spam_tracker[message_text] = deque(recent)
+        if len(recent) >= SPAM_THRESHOLD:
+            self.spam_records[message_text] = now
+            return list(set([entry[0] for entry in recent]))
+        elif recent and len(recent) < SPAM_THRESHOLD and (now - recent[0][1] > TIME_WINDOW):
+            self.spam_tracker.pop(message_text, None)
+        return []
+
+    def check_recent_spam(self, message_text, now):
+        timestamp = self.spam_records.get(message_text)
+        return timestamp and (now - timestamp <= SPAM_RECORD_DURATION)
+
+    def cleanup(self, now):
+        for message_text, timestamp in list(self.spam_records.items()):
+            if now - timestamp > SPAM_RECORD_DURATION:
+                del self.spam_records[message_text]
+
+    def matches_trigger(self, trigger, message_text):
+        normalized_trigger = trigger.strip().lower()
+        pattern = rf'(?<!\w)/?{re.escape(normalized_trigger)}(_\w+)?(?!\w)'
+        return re.search(pattern, message_text)
+
+    def moderate(self, raw_text, user_id, full_name, username, is_forward, now):
+        """Returns (action, spammer ids) for a non-admin message."""
+        if handled_command(raw_text, LEGACY_COMMANDS):
+            return COMMAND, None
+        message_text = raw_text.lower()
+        should_skip_spam_check = False
+
+        if len(message_text.strip()) < 2:
+            return "delete", None
+
+        name_username = f"{full_name} {username or ''}".lower()
+        if any(keyword in name_username for keyword in SUSPICIOUS_USERNAMES):
+            return "ban", None
+
+        if contains_non_x_links(raw_text):
+            return "delete", None
+        if contains_multiplication_phrase(message_text):
+            return "delete", None
+        if contains_give_sol_phrase(message_text):
+            return "delete", None
+        if is_forward:
+            return "delete", None
+
+        for trigger in self.filters.keys():
+            if self.matches_trigger(trigger, message_text):
+                should_skip_spam_check = True
+                break
+
+        if not should_skip_spam_check:
+            if message_text.strip() in self.whitelist_phrases:
+                should_skip_spam_check = True
+
+        if not should_skip_spam_check:
+            spammer_ids = self.check_for_spam(message_text, user_id, now)
+            if self.check_recent_spam(message_text, now) and user_id not in spammer_ids:
+                spammer_ids.append(user_id)
+            if spammer_ids:
+                return "mute_spammers", frozenset(spammer_ids)
+
+        for phrase in self.ban_phrases:
+            if re.search(r'\b' + re.escape(phrase) + r'\b', message_text):
+                return "ban", None
+        for phrase in self.mute_phrases:
+            if re.search(r'\b' + re.escape(phrase) + r'\b', message_text):
+                return "mute", None
+        for phrase in self.delete_phrases:
+            if re.search(r'\b' + re.escape(phrase) + r'\b', message_text):
+                return "delete", None
+        return ALLOWED, None
+
+    def respond(self, message_text):
+        """The filter trigger answered for an allowed message, or None."""
+        for trigger in self.filters:
+            if self.matches_trigger(trigger, message_text):
+                return trigger
+        return None
+
+class PipelineModerator:
+    """RuleEngine with its own spam window, as check_message runs it."""
+
+    def __init__(self, config, adaptive):
+        self.config = config
+        self.spam_store = MemorySpamStore(SPAM_THRESHOLD, TIME_WINDOW, SPAM_RECORD_DURATION)
+        self.engine = build_engine(config.rules, build_checks(config, SUSPICIOUS_USERNAMES, self.spam_check), adaptive=adaptive)
+
+    def spam_check(self, facts):
+        recent = self.spam_store.record(facts.text, facts.user_id, facts.now)
+        spammer_ids = list({entry[0] for entry in recent}) if len(recent) >= SPAM_THRESHOLD else []
+        if self.spam_store.is_recent_spam(facts.text, facts.now) and facts.user_id not in spammer_ids:
+            spammer_ids.append(facts.user_id)
+        return spammer_ids
+
+    def cleanup(self, now):
+        self.spam_store.cleanup(now)
+
+    def moderate(self, raw_text, user_id, full_name, username, is_forward, now):
+        if handled_command(raw_text, PIPELINE_COMMANDS):
+            return COMMAND, None
+        facts = MessageFacts(
+            text=raw_text.lower(),
+            raw_text=raw_text,
+            user_id=user_id,
+            full_name=full_name,
+            username=username,
+            is_forward=is_forward,
+            now=now,
+        )
+        decision = self.engine.evaluate(facts)
+        if decision is None:
+            return ALLOWED, None
+        return decision.action, frozenset(decision.detail) if decision.action == MUTE_SPAMMERS else None
+
+    def respond(self, message_text):
+        return self.config.match_trigger(message_text)
+
+class MessageGenerator:
+    """Random messages mixing real phrases and triggers with the inputs each check looks for."""
+
+    WORDS = ["gm", "wen", "moon", "ser", "the", "team", "is", "building", "hello", "lfg", "price", "chart", "when", "release", "ok", "thanks"]
+    LINKS = ["https://x.com/arcdotfun/status/1", "https://twitter.com/a/b", "https://evil.com/claim", "http://www.x.com/", "https://x.com"]
+    SPECIALS = ["5x", "10 x", "x 3", "give 10 sol", "give 5 solana", "x", "1", "", " ", "a", "!"]
+    COMMANDS = ["/filters", "/FILTERS", "/filters@arcbot", "/filters@otherbot", "/filters_more", "/rules", "/profile 10", "/say"]
+    NAMES = [("Alice", "alice"), ("Bob", None), ("Crypto Dev", "cdev"), ("Support Team", "help"), ("Eve", "arc_fan"), ("Zed", "zed")]
+
+    def __init__(self, config, rng):
+        self.rng = rng
+        self.fragments = (
+            config.ban_phrases + config.mute_phrases + config.delete_phrases + config.whitelist_phrases
+            + list(config.filters) + [f"{trigger.strip('/')}_more" for trigger in config.filters]
+        ) or self.WORDS
+        self.waves = []
+
+    def text(self):
+        rng = self.rng
+        # copy-paste waves: a few texts get repeated by many users
+        if self.waves and rng.random() < 0.3:
+            return rng.choice(self.waves)
+        parts = [rng.choice(self.WORDS) for _ in range(rng.randint(0, 4))]
+        if rng.random() < 0.4:
+            parts.insert(rng.randint(0, len(parts)), rng.choice(self.fragments))
+        if rng.random() < 0.1:
+            parts.append(rng.choice(self.LINKS))
+        if rng.random() < 0.1:
+            parts.append(rng.choice(self.SPECIALS))
+        if rng.random() < 0.05:
+            parts.insert(0, rng.choice(self.COMMANDS))
+        text = " ".join(parts)
+        if rng.random() < 0.2:
+            text = text.upper() if rng.random() < 0.5 else text.title()
+        if rng.random() < 0.05:
+            # waves often carry a listed phrase, so spam is checked against the phrase rules too
+            wave = f"{text} {rng.choice(self.fragments)}" if rng.random() < 0.5 else text
+            self.waves = (self.waves + [wave])[-5:]
+        return text
+
+    def message(self):
+        rng = self.rng
+        user_id = rng.randint(1, 50)
+        full_name, username = self.NAMES[user_id % len(self.NAMES)] if rng.random() < 0.2 else (f"User {user_id}", None)
+        return self.text(), user_id, full_name, username, rng.random() < 0.03
+
+def run(root, messages, seed):
+    config = build_config(root=root)
+    config.compile_all()
+    rng = random.Random(seed)
+    generator = MessageGenerator(config, rng)
+
+    legacy = LegacyModerator(config)
+    pipelines = {"static": PipelineModerator(config, adaptive=False), "adaptive": PipelineModerator(config, adaptive=True)}
+
+    outcomes = Counter()
+    mismatches = Counter()
+    samples = defaultdict(list)
+    now = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    next_cleanup = now + CLEANUP_INTERVAL
+
+    for _ in range(messages):
+        now += timedelta(seconds=rng.choice([0, 0, 0.5, 1, 2, 5, 20]))
+        if now >= next_cleanup:
+            for moderator in [legacy, *pipelines.values()]:
+                moderator.cleanup(now)
+            next_cleanup = now + CLEANUP_INTERVAL
+
+        message = generator.message()
+        expected = legacy.moderate(*message, now)
+        if expected[0] == ALLOWED:
+            expected = expected + (legacy.respond(message[0].lower()),)
+        outcomes[expected[0]] += 1
+
+        for name, pipeline in pipelines.items():
+            actual = pipeline.moderate(*message, now)
+            if actual[0] == ALLOWED:
+                actual = actual + (pipeline.respond(message[0].lower()),)
+            if actual != expected:
+                mismatches[name] += 1
+                if len(samples[name]) < SAMPLES:
+                    samples[name].append((message[0], expected, actual))
+
+    return outcomes, mismatches, samples
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--config", default=".", help="config tree to check (default: this checkout)")
+    parser.add_argument("--messages", type=int, default=30000, help="random messages to compare")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    outcomes, mismatches, samples = run(args.config, args.messages, args.seed)
+    print(f"{args.messages:,} messages: " + ", ".join(f"{action} {count:,}" for action, count in outcomes.most_common()))
+    for name in ("static", "adaptive"):
+        print(f"[{name}] {mismatches[name]:,} mismatches")
+        for text, expected, actual in samples[name]:
+            print(f"    {text!r}: expected {expected}, got {actual}")
+    sys.exit(1 if mismatches else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+"""Shadow-mode evaluation over a Telegram Desktop chat export.
+
+Streams result.json (single-chat or full-account export) and runs every text
+message through the moderation rule engine in dry-run mode. No Telegram calls
+are made. It reports what check_message would have done, per rule and action,
+with sample matches. With --compare it also runs a second config tree (another
+checkout holding filters/, blocklists/ and whitelists/) and reports the messages
+whose outcome differs.
+
+    python -m tools.shadow_eval result.json
+    python -m tools.shadow_eval result.json --compare ../tg_mod_main --admins 123,456
+    python -m tools.shadow_eval result.json --json data/shadow_report.json
+
+Memory stays bounded: the export is parsed incrementally, a fixed number of
+batches are in flight, and only counters and a few samples per rule are kept.
+Stateless checks run in a process pool. The spam window depends on message
+order, so it is resolved in the main process using message timestamps.
+"""
+import os
+import re
+import json
+import argparse
+from time import perf_counter
+from collections import Counter, deque
+from multiprocessing import get_context
+from datetime import datetime, timedelta, timezone
+
+from moderation.compiled_config import build_config
+from moderation.rules import SUSPICIOUS_USERNAMES, MessageFacts, build_checks, build_engine
+from moderation.spam_store import MemorySpamStore
+
+# Same spam window settings as moderation/handlers.py
+SPAM_THRESHOLD = 3
+TIME_WINDOW = timedelta(seconds=15)
+SPAM_RECORD_DURATION = timedelta(minutes=5)
+
+CHUNK_SIZE = 1 << 20
+BATCH_SIZE = 2000
+SAMPLE_TEXT_LENGTH = 200
+ALLOWED = "allow"
+
+MESSAGES_KEY = re.compile(r'"messages"\s*:\s*\[')
+
+def iter_export_messages(path, chunk_size=CHUNK_SIZE):
+    """Yields each object of every "messages" array in the export, reading chunk_size characters at a time.
+
+    Only the current chunk and the message being decoded are held in memory. A
+    literal "messages": [ can only occur as a key, since quotes inside JSON strings
+    are escaped.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    in_array = False
+    eof = False
+
+    with open(path, 'r', encoding='utf-8') as f:
+        while True:
+            if not in_array:
+                match = MESSAGES_KEY.search(buffer, pos)
+                if match:
+                    pos = match.end()
+                    in_array = True
+                    continue
+                if eof:
+                    return
+                # keep a short tail in case the key straddles two chunks
+                buffer = buffer[max(pos, len(buffer) - 64):]
+                pos = 0
+            else:
+                while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                    pos += 1
+                if pos < len(buffer) and buffer[pos] == ']':
+                    pos += 1
+                    in_array = False
+                    continue
+                if pos < len(buffer):
+                    try:
+                        message, pos = decoder.raw_decode(buffer, pos)
+                        yield message
+                        continue
+                    except json.JSONDecodeError:
+                        if eof:
+                            raise
+                elif eof:
+                    raise ValueError(f"{path}: export ends inside a messages array")
+                buffer = buffer[pos:]
+                pos = 0
+
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+            buffer += chunk
+
+def flatten_text(text):
+    """Export text is a string or a list of strings and {"type", "text"} entities."""
+    if isinstance(text, str):
+        return text
+    return "".join(part if isinstance(part, str) else part.get("text", "") for part in text or [])
+
+def message_row(message):
+    """Compact, picklable (text, user_id, full_name, is_forward, unix time) for a text message, else None."""
+    if message.get("type") != "message":
+        return None
+    text = flatten_text(message.get("text"))
+    if not text:
+        return None
+    user_id = int(re.sub(r'\D', '', message.get("from_id", "")) or 0)
+    if "date_unixtime" in message:
+        timestamp = int(message["date_unixtime"])
+    else:
+        timestamp = datetime.fromisoformat(message["date"]).replace(tzinfo=timezone.utc).timestamp()
+    return (text, user_id, message.get("from") or "", "forwarded_from" in message, timestamp)
+
+def row_facts(row):
+    text, user_id, full_name, is_forward, timestamp = row
+    return MessageFacts(
+        text=text.lower(),
+        raw_text=text,
+        user_id=user_id,
+        full_name=full_name,
+        username=None,  # exports don't carry usernames
+        is_forward=is_forward,
+        now=datetime.fromtimestamp(timestamp, timezone.utc),
+    )
+
+def iter_batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# worker side: stateless checks only
+
+WORKER_ENGINES = []
+
+def init_worker(roots):
+    def no_spam_check(facts):
+        raise RuntimeError("stateful rules are resolved in the main process")
+
+    for root in roots:
+        config = build_config(root=root)
+        WORKER_ENGINES.append(build_engine(config.rules, build_checks(config, SUSPICIOUS_USERNAMES, no_spam_check)))
+
+def check_batch(batch):
+    """For each row, the stateless check results of every config."""
+    return [[engine.check_all(row_facts(row)) for engine in WORKER_ENGINES] for row in batch]
+
+# main process: ordering, spam window, reporting
+
+class ShadowRun:
+    """Dry-run engine and counters for one config tree."""
+
+    def __init__(self, root, samples):
+        self.root = root
+        self.samples = samples
+        self.config = build_config(root=root)
+        self.spam_store = MemorySpamStore(SPAM_THRESHOLD, TIME_WINDOW, SPAM_RECORD_DURATION)
+        self.engine = build_engine(self.config.rules, build_checks(self.config, SUSPICIOUS_USERNAMES, self.spam_check))
+
+        self.decisions = Counter()   # deciding rule (or "allow") -> messages
+        self.actions = Counter()     # action -> messages
+        self.hits = Counter()        # rule -> messages it matched, whether or not it decided
+        self.sample_matches = {}     # deciding rule -> [(date, user_id, text, detail)]
+
+    def spam_check(self, facts):
+        recent = self.spam_store.record(facts.text, facts.user_id, facts.now)
+        spammer_ids = list({entry[0] for entry in recent}) if len(recent) >= SPAM_THRESHOLD else []
+        if self.spam_store.is_recent_spam(facts.text, facts.now) and facts.user_id not in spammer_ids:
+            spammer_ids.append(facts.user_id)
+        return spammer_ids
+
+    def evaluate(self, row, known):
+        facts = row_facts(row)
+        decision = self.engine.evaluate(facts, known=known)
+        for name, detail in known.items():
+            if detail is not None:
+                self.hits[name] += 1
+
+        if decision is None:
+            self.decisions[ALLOWED] += 1
+            return ALLOWED
+        name = decision.rule.name
+        if decision.rule.stateful:
+            self.hits[name] += 1
+        self.decisions[name] += 1
+        self.actions[decision.action] += 1
+        samples = self.sample_matches.setdefault(name, [])
+        if len(samples) < self.samples:
+            samples.append((facts.now.isoformat(), facts.user_id, row[0][:SAMPLE_TEXT_LENGTH], repr(decision.detail)))
+        return name
+
+    def report(self, total):
+        return {
+            "root": os.path.abspath(self.root),
+            "source_hash": self.config.source_hash,
+            "decisions": dict(self.decisions.most_common()),
+            "actions": dict(self.actions.most_common()),
+            "rule_hits": {name: self.hits[name] for name in (rule.name for rule in self.engine.order)},
+            "hit_rates": {name: count / total for name, count in self.hits.items()} if total else {},
+            "samples": self.sample_matches,
+        }
+
+def run(path, roots, processes, samples, admins, batch_size=BATCH_SIZE):
+    runs = [ShadowRun(root, samples) for root in roots]
+    transitions = Counter()
+    transition_samples = {}
+    total = 0
+    started = perf_counter()
+
+    rows = (row for row in map(message_row, iter_export_messages(path)) if row and row[1] not in admins)
+
+    def handle(batch, results):
+        nonlocal total
+        for row, knowns in zip(batch, results):
+            outcomes = [shadow.evaluate(row, known) for shadow, known in zip(runs, knowns)]
+            total += 1
+            if len(outcomes) == 2 and outcomes[0] != outcomes[1]:
+                key = f"{outcomes[0]} -> {outcomes[1]}"
+                transitions[key] += 1
+                key_samples = transition_samples.setdefault(key, [])
+                if len(key_samples) < samples:
+                    key_samples.append(row[0][:SAMPLE_TEXT_LENGTH])
+            if total % 100000 == 0:
+                # keep the spam window bounded on long exports
+                for shadow in runs:
+                    shadow.spam_store.cleanup(datetime.fromtimestamp(row[4], timezone.utc))
+                elapsed = perf_counter() - started
+                print(f"[SHADOW] {total:,} messages, {total / elapsed * 60:,.0f}/min")
+
+    if processes > 0:
+        with get_context("spawn").Pool(processes, initializer=init_worker, initargs=(roots,)) as pool:
+            # bounded number of batches in flight, handled in export order
+            pending = deque()
+            for batch in iter_batches(rows, batch_size):
+                pending.append((batch, pool.apply_async(check_batch, (batch,))))
+                if len(pending) >= processes * 2:
+                    batch, result = pending.popleft()
+                    handle(batch, result.get())
+            while pending:
+                batch, result = pending.popleft()
+                handle(batch, result.get())
+    else:
+        init_worker(roots)
+        for batch in iter_batches(rows, batch_size):
+            handle(batch, check_batch(batch))
+
+    elapsed = perf_counter() - started
+    report = {
+        "export": os.path.abspath(path),
+        "messages": total,
+        "seconds": elapsed,
+        "messages_per_minute": total / elapsed * 60 if elapsed else 0,
+        "configs": [shadow.report(total) for shadow in runs],
+    }
+    if len(runs) == 2:
+        report["diff"] = {
+            "changed": sum(transitions.values()),
+            "transitions": dict(transitions.most_common()),
+            "samples": transition_samples,
+        }
+    return report
+
+def print_report(report):
+    total = report["messages"]
+    print(f"\n{total:,} messages in {report['seconds']:.1f}s ({report['messages_per_minute']:,.0f}/min)")
+    for label, config in zip("AB", report["configs"]):
+        print(f"\n[{label}] {config['root']} (hash {config['source_hash'][:12]})")
+        for name, count in config["decisions"].items():
+            print(f"  {name:<16} {count:>10,}  {count / total:7.2%}" if total else f"  {name:<16} {count:>10,}")
+        print("  rule hits (decisive or not):")
+        for name, count in config["rule_hits"].items():
+            print(f"    {name:<16} {count:>10,}")
+        for name, rule_samples in config["samples"].items():
+            print(f"  samples for {name}:")
+            for date, user_id, text, detail in rule_samples:
+                print(f"    {date} user {user_id} [{detail}] {text!r}")
+    if "diff" in report:
+        diff = report["diff"]
+        print(f"\n[A -> B] {diff['changed']:,} messages change outcome")
+        for key, count in diff["transitions"].items():
+            print(f"  {key:<36} {count:>10,}")
+            for text in diff["samples"].get(key, []):
+                print(f"    {text!r}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("export", help="path to the Telegram Desktop result.json")
+    parser.add_argument("--config", default=".", help="config tree to evaluate (default: this checkout)")
+    parser.add_argument("--compare", help="second config tree to diff against --config")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="worker processes, 0 to run inline")
+    parser.add_argument("--samples", type=int, default=5, help="sample matches kept per rule")
+    parser.add_argument("--admins", default="", help="comma-separated user ids to skip, like the bot skips admins")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    roots = [args.config] + ([args.compare] if args.compare else [])
+    admins = {int(user_id) for user_id in args.admins.split(",") if user_id.strip()}
+    report = run(args.export, roots, args.processes, args.samples, admins)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()